@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_extrauserinformation_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extrauserinformation',
+            name='pushDigestMinutes',
+            field=models.IntegerField(choices=[(0, 'Direct'), (15, 'Per 15 minuten'), (60, 'Per uur'), (180, 'Per 3 uur')], default=0),
+        ),
+    ]
@@ -16,6 +16,27 @@ class ExtraUserInformation(models.Model):
     isPayedUser = models.BooleanField(default=False)
     expoToken = models.TextField(blank=True, null=True) # Single token for push notifications
     expoTokens = models.JSONField(blank=True, null=True, default=list) # New model field to store multiple tokens
+    PUSH_DIGEST_CHOICES = [
+        (0, 'Direct'),
+        (15, 'Per 15 minuten'),
+        (60, 'Per uur'),
+        (180, 'Per 3 uur'),
+    ]
+    pushDigestMinutes = models.IntegerField(choices=PUSH_DIGEST_CHOICES, default=0) # Deals within this window are combined into one push
+
+    # Compared by the feed timeline and push audience receivers in deals/models.py,
+    # so saves that change neither (e.g. the push digest setting) don't rebuild them
+    TRACKED_FIELDS = ('gender', 'expoToken')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
 
     def __str__(self):
         gender_map = {
@@ -38,6 +59,20 @@ class Device(models.Model):
     device_model = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Compared by the push audience receiver in deals/models.py, so the app
+    # re-registering an unchanged device on launch doesn't rebuild it
+    TRACKED_FIELDS = ('user_id', 'expo_token')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+
     def __str__(self):
         return f"{self.user.email} - {self.device_model} - {self.device_id}"
 
@@ -2,6 +2,7 @@
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+from django.db import transaction
 from django.db.models import Count, Q
 from django.db.models.functions import TruncDate
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
@@ -9,6 +10,7 @@ from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import render
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
 
 
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -25,6 +27,8 @@ import json
 
 from .serializers import MyTokenObtainPairSerializer, UserRegistrationSerializer, UserRegistrationSerializerV2
 from .models import API_Errors
+from .feed_pagination import InvalidCursor, decode_cursor, keyset_page, wants_cursor
+from . import feed_cache
 from deals import models as deals_models
 from pages import models as pages_models
 from accounts import models as accounts_models
@@ -162,38 +166,23 @@ def get_highlighted_sales_v2(user):
         gender_of_user = getattr(user.extrauserinformation, 'gender', None)
         subscribed_store_ids = list(user.subscribed_stores.values_list('id', flat=True))
 
-        # 2. Define gender filters for sales
-        if gender_of_user == 0:
-            gender_filters = Q(message__email_to="gijsgprojects@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        elif gender_of_user == 1:
-            gender_filters = Q(message__email_to="donnapatrona79@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        else:
-            gender_filters = Q()
-
-        # 3. Define date range and base filters
+        # 2. Active sales of the past 5 days for the user's gender (deals.models.ActiveSale)
         five_days_ago = timezone.now() - timedelta(days=5)
-        sales_qs = deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=five_days_ago,
-            message__store__isnull=False,
-            is_new_deal_better=True
-        ).filter(
-            gender_filters
+        sales_qs = deals_models.ActiveSale.objects.visible_to(gender_of_user).filter(
+            received_date__gte=five_days_ago
         ).exclude(
-            message__store__id__in=subscribed_store_ids
-        ).annotate(
-            click_count=Count('click', distinct=True) + Count('clicknoauth', distinct=True)
+            store_id__in=subscribed_store_ids
+        ).select_related('store').annotate(
+            click_count=Count('analysis__click', distinct=True) + Count('analysis__clicknoauth', distinct=True)
         ).order_by('-click_count')
 
-        # 4. Filter to get one sale per store and calculate the limit (top 20%)
+        # 3. Filter to get one sale per store and calculate the limit (top 20%)
         unique_sales_by_store = []
         seen_store_ids = set()
         for sale in sales_qs:
-            if sale.message.store.id not in seen_store_ids:
+            if sale.store_id not in seen_store_ids:
                 unique_sales_by_store.append(sale)
-                seen_store_ids.add(sale.message.store.id)
+                seen_store_ids.add(sale.store_id)
 
         if not unique_sales_by_store:
             return []
@@ -203,20 +192,20 @@ def get_highlighted_sales_v2(user):
         limit = max(1, int(len(unique_sales_by_store) * 0.75))
         top_sales = unique_sales_by_store[:limit]
 
-        # 5. Serialize the results
+        # 4. Serialize the results
         highlighted_sales = []
-        for analysis in top_sales:
+        for sale in top_sales:
             data = {
                 'type': 'highlighted_sale',
-                'title': analysis.title,
-                'grabber': analysis.grabber,
-                'description': analysis.description,
-                'storeName': analysis.message.store.name,
-                'mainLink': f"deals/visit/{analysis.id}/{user.id}/" if user else f"deals/visit/{analysis.id}/0/",
-                'messageId': analysis.message.id,
-                'analysisId': analysis.id,
-                'dateReceived': analysis.message.received_date,
-                'parsedDateReceived': parse_date_received(analysis.message.received_date),
+                'title': sale.title,
+                'grabber': sale.grabber,
+                'description': sale.description,
+                'storeName': sale.store.name,
+                'mainLink': f"deals/visit/{sale.analysis_id}/{user.id}/" if user else f"deals/visit/{sale.analysis_id}/0/",
+                'messageId': sale.message_id,
+                'analysisId': sale.analysis_id,
+                'dateReceived': sale.received_date,
+                'parsedDateReceived': parse_date_received(sale.received_date),
             }
             highlighted_sales.append(data)
         return highlighted_sales
@@ -226,6 +215,22 @@ def get_highlighted_sales_v2(user):
         return []
 
 
+def get_cached_highlighted_sales(user):
+    """
+    get_highlighted_sales_v2() for the "my feed" pages, computed once per
+    FEED_EXTRAS_CACHE_SECONDS per user instead of on every page request.
+    """
+    key = f"highlighted_sales:{user.id}"
+    sales = cache.get(key)
+    if sales is None:
+        sales = get_highlighted_sales_v2(user)
+        cache.set(key, sales, settings.FEED_EXTRAS_CACHE_SECONDS)
+    # Relative dates are not cached
+    for sale in sales:
+        sale['parsedDateReceived'] = parse_date_received(sale['dateReceived'])
+    return sales
+
+
 def get_sponsors(active=False):
     if not active: return []
     via_appia = deals_models.Store.objects.get(id=44)
@@ -309,9 +314,24 @@ def parse_date_received(date_received):
 
 def serialize_feed_item(item, user):
     """
-    Turns a GmailSaleAnalysis or Store into a dict suitable for the feed response.
+    Turns an ActiveSale, GmailSaleAnalysis or Store into a dict suitable for the feed response.
     """
-    if hasattr(item, 'message'):  # GmailSaleAnalysis
+    if isinstance(item, deals_models.ActiveSale):
+        a = item
+        s = "Er is een nieuwe deal beschikbaar!"
+        d = "Bekijk jouw nieuwe deal door op de knop te klikken."
+        return {
+            'type': 'sale',
+            'title': a.title,
+            'grabber': a.grabber if a.grabber != "N/A" else s,
+            'description': a.description if a.description != "N/A" else d,
+            'storeName': a.store.name,
+            'mainLink': f"deals/visit/{a.analysis_id}/{user.id}/" if user else f"deals/visit/{a.analysis_id}/0/",
+            'messageId': a.message_id,
+            'dateReceived': a.received_date,
+            'parsedDateReceived': parse_date_received(a.received_date),
+        }
+    elif hasattr(item, 'message'):  # GmailSaleAnalysis
         a = item
         s = "Er is een nieuwe deal beschikbaar!"
         d = "Bekijk jouw nieuwe deal door op de knop te klikken."
@@ -372,6 +392,37 @@ def inject_extras(response, page_number, new_stores_to_inject, sponsors_to_injec
     return response
 
 
+def paginate_feed(data, items):
+    """
+    Returns (page_number, page items, pagination fields for the response).
+    Uses keyset pagination when the request sends "cursor" (api/feed_pagination.py),
+    page numbers with a Paginator otherwise.
+    """
+    if wants_cursor(data):
+        page_number, page_items, next_cursor, has_next_page = keyset_page(items, data.get('cursor'), ITEMS_PER_PAGE)
+        return page_number, page_items, {
+            'has_next_page': has_next_page,
+            'page': page_number,
+            'next_cursor': next_cursor,
+        }
+
+    page_number = int(data.get('page', 1))
+    paginator = Paginator(items, ITEMS_PER_PAGE)
+    try:
+        page_obj = paginator.page(page_number)
+    except PageNotAnInteger:
+        page_obj = paginator.page(1)
+        page_number = 1
+    except EmptyPage:
+        page_obj = paginator.page(paginator.num_pages)
+        page_number = paginator.num_pages
+    return page_number, page_obj.object_list, {
+        'has_next_page': page_obj.has_next(),
+        'page': page_number,
+        'total_pages': paginator.num_pages,
+    }
+
+
 @api_view(['POST'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -385,34 +436,11 @@ def IOS_API_fetch_my_feed(request):
 
     try:
         data = json.loads(request.body)
-        page_number = int(data.get('page', 1))
         user = request.user
 
-        # Subscribed stores
-        subscribed_stores = deals_models.Store.objects.filter(subscriptions=user)
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-
-        # Gender filters
-        gender_of_user = getattr(user.extrauserinformation, 'gender', None)
-        if gender_of_user == 0:
-            gender_filters = Q(message__email_to="gijsgprojects@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        elif gender_of_user == 1:
-            gender_filters = Q(message__email_to="donnapatrona79@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        else:
-            gender_filters = Q()
-
-        # Sales
-        sales_qs = deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=three_weeks_ago,
-            message__store__isnull=False,
-            message__store__in=subscribed_stores,
-            is_new_deal_better=True
-        ).filter(
-            gender_filters
-        ).select_related('message').order_by('-message__received_date')
+        # Sales of the subscribed stores: the user's timeline, written when a sale
+        # comes in (deals.models.FeedTimelineEntry)
+        timeline = deals_models.FeedTimelineEntry.objects.for_user(user)
 
         # New stores
         gender_preference_user = ["M", "F", "B"][user.extrauserinformation.gender]
@@ -427,126 +455,116 @@ def IOS_API_fetch_my_feed(request):
         else:
             new_stores = list(deals_models.Store.objects.filter(dateIssued__gte=seven_days_ago).order_by('-dateIssued'))
 
-        # Paginate
-        paginator = Paginator(sales_qs, ITEMS_PER_PAGE)
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-            page_number = 1
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-            page_number = paginator.num_pages
+        # Paginate: a range read on the timeline, then one query for the sales of the page
+        page_number, page_entries, pagination = paginate_feed(data, timeline)
+        page_items = deals_models.FeedTimelineEntry.objects.hydrate(page_entries)
 
         # Serialize
-        response = [serialize_feed_item(item, user) for item in page_obj.object_list]
+        response = [serialize_feed_item(item, user) for item in page_items]
         serialized_new_stores = [serialize_feed_item(item, user) for item in new_stores]
 
         # Inject extras - passing all potential items to the injection function
-        response = inject_extras(response, page_number, serialized_new_stores, get_sponsors(), get_highlighted_sales_v2(user))
+        response = inject_extras(response, page_number, serialized_new_stores, get_sponsors(), get_cached_highlighted_sales(user))
 
         return Response({
             'success': True,
             'items': response,
-            'has_next_page': page_obj.has_next(),
-            'page': page_number,
-            'total_pages': paginator.num_pages,
+            **pagination,
         })
 
+    except InvalidCursor:
+        return Response({'error': 'Ongeldige cursor.'}, status=400)
     except Exception as e:
         API_Errors.objects.create(task="Fetch my feed", error=str(e))
         return Response({'error': 'Er ging iets mis.'}, status=500)
 
 
 
+def build_feed_no_auth(data, max_preview_pages=2):
+    """
+    Builds the response payload of IOS_API_fetch_feed_no_auth for a request body.
+    This version now paginates only sales and then injects new stores,
+    mirroring the structure of the authenticated feed.
+    """
+    if wants_cursor(data):
+        page_number = decode_cursor(data.get('cursor'))[0]
+    else:
+        page_number = int(data.get('page', 1))
+
+    if page_number > max_preview_pages:
+        return {
+            'success': True,
+            'items': [],
+            'has_next_page': False,
+            'page': page_number,
+            'total_pages': max_preview_pages,
+        }
+
+    # 1-2. One sale per store per day: the precomputed daily picks (deals.models.ActiveSale)
+    unique_sales = deals_models.ActiveSale.objects.visible_to(None).filter(is_daily_pick=True).select_related('store')
+    
+    # 3. Fetch all potential items for injection (new stores)
+    seven_days_ago = timezone.now() - timedelta(days=7)
+    new_stores = list(deals_models.Store.objects.filter(dateIssued__gte=seven_days_ago).order_by('-dateIssued'))
+
+    # 4. Paginate ONLY the main feed content (the unique sales)
+    page_number, page_items, pagination = paginate_feed(data, unique_sales)
+    if 'next_cursor' in pagination and page_number >= max_preview_pages:
+        # The preview ends here, don't hand out a cursor to a page that is always empty
+        pagination.update(has_next_page=False, next_cursor=None)
+
+    # 5. Serialize the items for the current page and the items to be injected
+    # Note: Pass `user=None` as there is no authenticated user.
+    serialized_sales = [serialize_feed_item(item, None) for item in page_items]
+    serialized_new_stores = [serialize_feed_item(item, None) for item in new_stores]
+    
+    # For the non-auth feed, we don't have sponsors or highlighted sales.
+    sponsors = []
+    highlighted_sales = []
+
+    # 6. Inject the extra items into the serialized list of sales
+    response_items = inject_extras(
+        serialized_sales, 
+        page_number, 
+        serialized_new_stores, 
+        sponsors, 
+        highlighted_sales
+    )
+
+    return {
+        'success': True,
+        'items': response_items,
+        **pagination,
+    }
+
+
 # NEEDS MODIFY LIKE ABOVE #
 # --- MODIFIED AND IMPROVED FUNCTION USING INJECTION LOGIC --- #
 @api_view(['POST'])
+@authentication_classes([]) # anonymous, a cache hit must not look up a user
 @csrf_exempt
 def IOS_API_fetch_feed_no_auth(request, max_preview_pages=2):
     """
-    Returns a generic feed for non-authenticated users.
-    This version now paginates only sales and then injects new stores,
-    mirroring the structure of the authenticated feed.
+    Returns a generic feed for non-authenticated users, from the shared
+    cache (api/feed_cache.py) when possible.
     """
 
     try:
         data = json.loads(request.body)
-        page_number = int(data.get('page', 1))
+        payload = feed_cache.get_page(data, max_preview_pages)
+        if payload is None:
+            payload = build_feed_no_auth(data, max_preview_pages)
+            feed_cache.set_page(data, payload, max_preview_pages)
 
-        if page_number > max_preview_pages:
-            return Response({
-                'success': True,
-                'items': [],
-                'has_next_page': False,
-                'page': page_number,
-                'total_pages': max_preview_pages,
-            })
-
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-
-        # 1. Fetch all potential sales items
-        sales = list(deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=three_weeks_ago,
-            message__store__isnull=False,
-            is_new_deal_better=True
-        ).select_related('message', 'message__store').order_by('-message__received_date'))
-        
-        # 2. Filter to one unique sale per store per day (retained from original logic)
-        unique_sales = []
-        seen_store_days = set()
-        for sale in sales:
-            if sale.message and sale.message.store:
-                store_id = sale.message.store.id
-                sale_date = sale.message.received_date.date()
-                if (store_id, sale_date) not in seen_store_days:
-                    unique_sales.append(sale)
-                    seen_store_days.add((store_id, sale_date))
-        
-        # 3. Fetch all potential items for injection (new stores)
-        seven_days_ago = timezone.now() - timedelta(days=7)
-        new_stores = list(deals_models.Store.objects.filter(dateIssued__gte=seven_days_ago).order_by('-dateIssued'))
-
-        # 4. Paginate ONLY the main feed content (the unique sales)
-        paginator = Paginator(unique_sales, ITEMS_PER_PAGE)
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-            page_number = 1
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-            page_number = paginator.num_pages if paginator.num_pages > 0 else 1
-
-        # 5. Serialize the items for the current page and the items to be injected
-        # Note: Pass `user=None` as there is no authenticated user.
-        serialized_sales = [serialize_feed_item(item, None) for item in page_obj.object_list]
-        serialized_new_stores = [serialize_feed_item(item, None) for item in new_stores]
-        
-        # For the non-auth feed, we don't have sponsors or highlighted sales.
-        sponsors = []
-        highlighted_sales = []
-
-        # 6. Inject the extra items into the serialized list of sales
-        response_items = inject_extras(
-            serialized_sales, 
-            page_number, 
-            serialized_new_stores, 
-            sponsors, 
-            highlighted_sales
-        )
+        # Relative dates are not cached
+        for item in payload['items']:
+            if item.get('dateReceived'):
+                item['parsedDateReceived'] = parse_date_received(item['dateReceived'])
 
-        return Response({
-            'success': True,
-            'items': response_items,
-            'has_next_page': page_obj.has_next(),
-            'page': page_number,
-            'total_pages': paginator.num_pages,
-        })
+        return Response(payload)
 
+    except InvalidCursor:
+        return Response({'error': 'Ongeldige cursor.'}, status=400)
     except Exception as e:
         API_Errors.objects.create(task="Fetch my feed no auth", error=str(e))
         return Response({'error': 'Er ging iets mis.'}, status=500)
@@ -581,28 +599,20 @@ def IOS_API_fetch_stores(request):
 
         # --- REFACTORED ANNOTATION LOGIC ---
 
-        # 1. Define gender filters for sales emails, relative to Store
+        # 1. Define gender filters for active sales, relative to Store
         gender_of_user = getattr(user.extrauserinformation, 'gender', None)
         gender_sales_filter = Q()
-        if gender_of_user == 0 and search_query == '': # Male
-            gender_sales_filter = Q(gmailmessage__email_to="gijsgprojects@gmail.com") | Q(gmailmessage__store__genderPreferenceSet=False)
-        elif gender_of_user == 1 and search_query == '': # Female
-            gender_sales_filter = Q(gmailmessage__email_to="donnapatrona79@gmail.com") | Q(gmailmessage__store__genderPreferenceSet=False)
-            
-        # 2. Define the main filter for active sales, relative to Store
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-        active_sales_filter = Q(
-            gmailmessage__analysis__is_sale_mail=True,
-            gmailmessage__analysis__is_personal_deal=False,
-            gmailmessage__analysis__is_new_deal_better=True,
-            gmailmessage__analysis__deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            gmailmessage__received_date__gte=three_weeks_ago
-        )
+        buckets = deals_models.ActiveSale.buckets_for(gender_of_user)
+        if buckets is not None and search_query == '':
+            gender_sales_filter = Q(active_sales__gender__in=buckets)
+
+        # 2. Define the main filter for active sales (deals.models.ActiveSale), relative to Store
+        active_sales_filter = Q(active_sales__received_date__gte=deals_models.ActiveSale.objects.window_start())
 
         # 3. Combine filters and annotate the count onto the main queryset
         final_sales_filter = active_sales_filter & gender_sales_filter
         queryset = queryset.annotate(
-            active_sales_count=Count('gmailmessage', filter=final_sales_filter, distinct=True)
+            active_sales_count=Count('active_sales', filter=final_sales_filter, distinct=True)
         )
 
         # Apply sorting
@@ -664,20 +674,13 @@ def IOS_API_fetch_stores_no_auth(request):
 
         # --- REFACTORED ANNOTATION LOGIC ---
 
-        # 1. Define the filter for active sales, relative to Store
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-        active_sales_filter = Q(
-            gmailmessage__analysis__is_sale_mail=True,
-            gmailmessage__analysis__is_personal_deal=False,
-            gmailmessage__analysis__is_new_deal_better=True,
-            gmailmessage__analysis__deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            gmailmessage__received_date__gte=three_weeks_ago
-        )
+        # 1. Define the filter for active sales (deals.models.ActiveSale), relative to Store
+        active_sales_filter = Q(active_sales__received_date__gte=deals_models.ActiveSale.objects.window_start())
 
         # 2. Annotate the count onto every store in the queryset
         queryset = queryset.annotate(
             active_sales_count=Count(
-                TruncDate('gmailmessage__received_date'), filter=active_sales_filter, distinct=True
+                TruncDate('active_sales__received_date'), filter=active_sales_filter, distinct=True
             )
         )
 
@@ -726,31 +729,12 @@ def IOS_API_fetch_public_sales(request):
     sleep(SLEEP_TIME)
     try:
         data = json.loads(request.body)
-        page_number = int(data.get('page', 1))
         user = request.user
 
-        # Gender filters
         gender_of_user = getattr(user.extrauserinformation, 'gender', None)
-        if gender_of_user == 0:
-            gender_filters = Q(message__email_to="gijsgprojects@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        elif gender_of_user == 1:
-            gender_filters = Q(message__email_to="donnapatrona79@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        else:
-            gender_filters = Q()
-
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-
-        # Get all GmailMessages related to those stores
-        sales_qs = deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=three_weeks_ago,
-            message__store__isnull=False,
-            is_new_deal_better=True
-        ).filter(
-            gender_filters
-        ).select_related('message', 'message__store').order_by('-message__received_date')
+
+        # Active sales for the user's gender (deals.models.ActiveSale)
+        sales_qs = deals_models.ActiveSale.objects.visible_to(gender_of_user).select_related('store')
 
         # If gender is 'both', filter to one sale per store per day.
         # Also fetch new stores based on gender preference for injection
@@ -768,43 +752,26 @@ def IOS_API_fetch_public_sales(request):
 
 
         if gender_of_user == 2:
-            unique_sales = []
-            seen_store_days = set()
-            for sale in sales_qs:
-                if sale.message and sale.message.store:
-                    store_id = sale.message.store.id
-                    sale_date = sale.message.received_date.date()
-                    if (store_id, sale_date) not in seen_store_days:
-                        unique_sales.append(sale)
-                        seen_store_days.add((store_id, sale_date))
-            paginatable_items = unique_sales
+            paginatable_items = sales_qs.filter(is_daily_pick=True)
         else:
             paginatable_items = sales_qs
 
         # Paginate
-        paginator = Paginator(paginatable_items, ITEMS_PER_PAGE)
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-            page_number = 1
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-            page_number = paginator.num_pages
+        page_number, page_items, pagination = paginate_feed(data, paginatable_items)
 
         # Serialize
         response = []
-        for analysis in page_obj:
+        for analysis in page_items:
             response.append(serialize_feed_item(analysis, user))
 
         response = inject_extras(response, page_number, serialized_new_stores, get_sponsors(), [])
         return Response({
             'success': True,
             'items': response,
-            'has_next_page': page_obj.has_next(),
-            'page': page_number,
-            'total_pages': paginator.num_pages,
+            **pagination,
         })
+    except InvalidCursor:
+        return Response({'error': 'Ongeldige cursor.'}, status=400)
     except Exception as e:
         API_Errors.objects.create(task="Fetch public sales", error=str(e))
         return Response({'error': 'Er ging iets mis.'}, status=500)
@@ -831,26 +798,17 @@ def IOS_API_fetch_account_details(request):
         user_data = {
             'userId': user.id,
             'email': user.email,
-            'gender': gender_map.get(extra_info.gender)
+            'gender': gender_map.get(extra_info.gender),
+            'pushDigestMinutes': extra_info.pushDigestMinutes,
         }
         subscriptions_qs = deals_models.Store.objects.filter(subscriptions=user).order_by('name')
 
-        # Gender filters for sales count
+        # Active sales for the user's gender, for the sales count
         gender_of_user = getattr(user.extrauserinformation, 'gender', None)
-        if gender_of_user == 0:
-            gender_filters = Q(message__email_to="gijsgprojects@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        elif gender_of_user == 1:
-            gender_filters = Q(message__email_to="donnapatrona79@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        else:
-            gender_filters = Q()
+        active_sales = deals_models.ActiveSale.objects.visible_to(gender_of_user)
 
         def get_active_sales_count(store):
-            one_month_ago = timezone.now() - timedelta(days=21)
-            return deals_models.GmailSaleAnalysis.objects.filter(
-                message__store=store, is_sale_mail=True, is_personal_deal=False,
-                is_new_deal_better=True, deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-                message__received_date__gte=one_month_ago
-            ).filter(gender_filters).count()
+            return active_sales.filter(store=store).count()
 
         paginator = Paginator(subscriptions_qs, ITEMS_PER_PAGE * 2)
         try:
@@ -927,36 +885,21 @@ def IOS_API_fetch_store_data(request):
         store = deals_models.Store.objects.get(id=store_id)
         user = request.user
 
-        # Gender filters
+        # get active sales (deals.models.ActiveSale)
         gender_of_user = getattr(user.extrauserinformation, 'gender', None)
-        if gender_of_user == 0:
-            gender_filters = Q(message__email_to="gijsgprojects@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        elif gender_of_user == 1:
-            gender_filters = Q(message__email_to="donnapatrona79@gmail.com") | Q(message__store__genderPreferenceSet=False)
-        else:
-            gender_filters = Q()
-        # get active sales
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-        active_sales = deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=three_weeks_ago,
-            message__store=store,
-            is_new_deal_better=True
-        ).filter(gender_filters).select_related('message').order_by('-message__received_date')
+        active_sales = deals_models.ActiveSale.objects.visible_to(gender_of_user).filter(store=store)
         serialized_sales = []
         for sale in active_sales:
             serialized_sales.append({
-                'id': sale.id,
+                'id': sale.analysis_id,
                 'title': sale.title,
                 'storeName': store.name,
                 'grabber': sale.grabber if sale.grabber != "N/A" else "Er is een nieuwe deal beschikbaar!",
                 'description': sale.description if sale.description != "N/A" else "Bekijk jouw nieuwe deal door op de knop te klikken.",
-                'messageId': sale.message.id,
-                'dateReceived': sale.message.received_date,
-                'parsedDateReceived': parse_date_received(sale.message.received_date),
-                'mainLink': f"deals/visit/{sale.id}/{user.id}/",
+                'messageId': sale.message_id,
+                'dateReceived': sale.received_date,
+                'parsedDateReceived': parse_date_received(sale.received_date),
+                'mainLink': f"deals/visit/{sale.analysis_id}/{user.id}/",
             })
 
         description = f"Op SaleDrop sinds {parse_date_issued(store.dateIssued)}"
@@ -1019,44 +962,24 @@ def IOS_API_fetch_store_data_no_auth(request):
         page_number = int(data.get('page', 1)) # Read page number from request
         store = deals_models.Store.objects.get(id=store_id)
         
-        three_weeks_ago = timezone.now() - timedelta(days=21)
-
-        # Fetch all sales for the store, ordered by most recent first.
-        active_sales_qs = deals_models.GmailSaleAnalysis.objects.filter(
-            is_sale_mail=True,
-            is_personal_deal=False,
-            deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
-            message__received_date__gte=three_weeks_ago,
-            message__store=store,
-            is_new_deal_better=True
-        ).select_related('message').order_by('-message__received_date')
-
-
-        # Filter to one sale per day in Python to avoid database-specific features.
-        unique_sales = []
-        seen_dates = set()
-        for sale in active_sales_qs:
-            sale_date = sale.message.received_date.date()
-            if sale_date not in seen_dates:
-                unique_sales.append(sale)
-                seen_dates.add(sale_date)
-        print(f"Unique sales count: {len(unique_sales)}")
+        # One active sale per day for the store (deals.models.ActiveSale daily picks), most recent first.
+        unique_sales = deals_models.ActiveSale.objects.visible_to(None).filter(store=store, is_daily_pick=True)
 
 
         # --- SERIALIZATION LOGIC ---
         serialized_sales = []
         for sale in unique_sales:
             serialized_sales.append({
-                'id': sale.id,
+                'id': sale.analysis_id,
                 'storeName': store.name,
                 'title': sale.title,
                 'grabber': sale.grabber if sale.grabber != "N/A" else "Er is een nieuwe deal beschikbaar!",
                 'description': sale.description if sale.description != "N/A" else "Bekijk jouw nieuwe deal door op de knop te klikken.",
-                'messageId': sale.message.id,
-                'dateReceived': sale.message.received_date,
+                'messageId': sale.message_id,
+                'dateReceived': sale.received_date,
                 # Use the relative date parser for consistency
-                'parsedDateReceived': parse_date_received(sale.message.received_date),
-                'mainLink': f"deals/visit/{sale.id}/0/",
+                'parsedDateReceived': parse_date_received(sale.received_date),
+                'mainLink': f"deals/visit/{sale.analysis_id}/0/",
             })
             
         description = f"Op SaleDrop sinds {parse_date_issued(store.dateIssued)}"
@@ -1145,21 +1068,31 @@ def IOS_API_save_expo_token(request):
 
         user = request.user
 
-        # 1. Ensure the expo_token is unique. If any other device (regardless of user)
-        # has this token, it's stale. We can safely remove that device record.
-        accounts_models.Device.objects.filter(expo_token=expo_token).delete()
-
-        # 2. Clean up the old expoToken field from ExtraUserInformation if it exists.
-        accounts_models.ExtraUserInformation.objects.filter(expoToken=expo_token).update(expoToken=None)
-
-        # 3. Use update_or_create, keyed on the unique device_id.
-        # - If a device with this ID exists, it will be updated with the new user and token.
-        # - If not, a new device record will be created.
-        # This correctly handles transferring a device between users.
-        accounts_models.Device.objects.update_or_create(
-            device_id=device_id,
-            defaults={'user': user, 'expo_token': expo_token, 'device_model': device_model}
-        )
+        # One transaction, so a push dispatch never sees the device half re-registered
+        with transaction.atomic():
+            # 1. Ensure the expo_token is unique. If any other device (regardless of user)
+            # has this token, it's stale. We can safely remove that device record.
+            # This device itself is kept, so an unchanged launch doesn't touch the push audience.
+            accounts_models.Device.objects.filter(expo_token=expo_token).exclude(device_id=device_id).delete()
+
+            # 2. Clean up the old expoToken field from ExtraUserInformation if it exists.
+            # .update() sends no signals, so the push audience of those users is rebuilt here.
+            legacy_user_ids = list(
+                accounts_models.ExtraUserInformation.objects.filter(expoToken=expo_token).values_list('user_id', flat=True)
+            )
+            if legacy_user_ids:
+                accounts_models.ExtraUserInformation.objects.filter(user_id__in=legacy_user_ids, expoToken=expo_token).update(expoToken=None)
+                for legacy_user_id in legacy_user_ids:
+                    deals_models.PushAudience.objects.rebuild_user(legacy_user_id)
+
+            # 3. Use update_or_create, keyed on the unique device_id.
+            # - If a device with this ID exists, it will be updated with the new user and token.
+            # - If not, a new device record will be created.
+            # This correctly handles transferring a device between users.
+            accounts_models.Device.objects.update_or_create(
+                device_id=device_id,
+                defaults={'user': user, 'expo_token': expo_token, 'device_model': device_model}
+            )
 
         return JsonResponse({'success': True, 'message': 'Device registered successfully.'})
 
@@ -1169,6 +1102,31 @@ def IOS_API_save_expo_token(request):
         return JsonResponse({'error': 'An internal error occurred.'}, status=500)
 
 
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def IOS_API_change_push_digest(request):
+    """
+    Sets how long deals are collected into one push notification.
+    Expects {'pushDigestMinutes': 0 | 15 | 60 | 180}, 0 sends every deal right away.
+    """
+    try:
+        data = json.loads(request.body)
+        minutes = data.get('pushDigestMinutes')
+        allowed = [choice for choice, _ in accounts_models.ExtraUserInformation.PUSH_DIGEST_CHOICES]
+        if minutes not in allowed:
+            return JsonResponse({'error': 'Invalid digest setting.'}, status=400)
+
+        extra_info = request.user.extrauserinformation
+        extra_info.pushDigestMinutes = minutes
+        extra_info.save(update_fields=['pushDigestMinutes'])
+        return JsonResponse({'success': True, 'message': 'Succesvol aangepast.'})
+
+    except Exception as e:
+        API_Errors.objects.create(task="Change push digest", error=str(e))
+        return JsonResponse({'error': 'Er ging iets mis.'}, status=500)
+
+
 @api_view(['POST'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,83 @@
+"""
+Shared response cache for the logged-out feed (IOS_API_fetch_feed_no_auth).
+
+Every logged-out app gets the same preview pages, so they are built once and
+served from Redis (Django's cache framework, CACHES['default']), keyed on the
+page number, or on the page of the cursor in cursor mode. Only the preview
+pages are cached, and only for the cursors the cache handed out, so the number
+of keys per generation is bounded. A cache hit does not touch the database.
+
+Pages expire after FEED_NO_AUTH_CACHE_SECONDS. When a new sale enters the
+feed (an ActiveSale row is created, see the receiver in api/models.py) the
+refresh_feed_no_auth_cache task starts a new cache generation, which orphans
+every cached page at once, and builds the first pages again.
+
+The cached items keep dateReceived; the view recomputes parsedDateReceived
+from it on every request, so relative dates don't go stale.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.feed_pagination import decode_cursor, wants_cursor
+
+GENERATION_KEY = 'feed_no_auth:generation'
+
+# The requests of a cold app launch, built ahead by the refresh task
+PREVIEW_REQUESTS = [{'page': 1}, {'page': 2}, {'cursor': None}]
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _key(generation, page) -> str:
+    return f"feed_no_auth:{generation}:{page}"
+
+
+def cache_key(data, max_preview_pages=2):
+    """
+    Returns the cache key of a request body, or None when it is not cached:
+    pages past the preview (always empty) and cursors this cache did not hand out.
+    Keying on the raw cursor would let any forged cursor add an entry.
+    """
+    generation = _generation()
+    if not wants_cursor(data):
+        page_number = int(data.get('page', 1))
+        if not 1 <= page_number <= max_preview_pages:
+            return None
+        return _key(generation, f"page:{page_number}")
+
+    cursor = data.get('cursor')
+    if not cursor:
+        return _key(generation, 'cursor:1')
+    page_number = decode_cursor(cursor)[0]
+    if not 2 <= page_number <= max_preview_pages:
+        return None
+    # Only the next_cursor of the cached previous page
+    previous = cache.get(_key(generation, f"cursor:{page_number - 1}"))
+    if previous is None or previous.get('next_cursor') != cursor:
+        return None
+    return _key(generation, f"cursor:{page_number}")
+
+
+def get_page(data, max_preview_pages=2):
+    """Returns the cached response payload for a request body, or None."""
+    key = cache_key(data, max_preview_pages)
+    return cache.get(key) if key else None
+
+
+def set_page(data, payload, max_preview_pages=2):
+    key = cache_key(data, max_preview_pages)
+    if key:
+        cache.set(key, payload, settings.FEED_NO_AUTH_CACHE_SECONDS)
+
+
+def invalidate():
+    """Starts a new generation; the pages of the old one are never read again and expire."""
+    cache.set(GENERATION_KEY, time.time_ns(), None)
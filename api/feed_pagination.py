@@ -0,0 +1,62 @@
+"""
+Keyset (cursor) pagination for the v2 feeds.
+
+Paginator runs a COUNT(*) over the whole feed and an OFFSET query per page,
+which gets slower the further the app scrolls. In cursor mode a page is the
+next `per_page` rows (ActiveSale, or FeedTimelineEntry for "my feed") after
+the last one the app has seen, ordered by (received_date, id) descending,
+fetched with one LIMIT query on a received_date index and without a count.
+
+The cursor is opaque to the app: it encodes the page number of the next page
+(the injected new stores and sponsors are placed per page) and the key of the
+last row of the current page. The app opts in by sending "cursor" in the
+request body, null for the first page, and then the next_cursor of every
+response; has_next_page tells it when to stop.
+"""
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.encoding import force_bytes, force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def wants_cursor(data) -> bool:
+    return 'cursor' in data
+
+
+def encode_cursor(page_number, item) -> str:
+    return urlsafe_base64_encode(force_bytes(f"{page_number}|{item.received_date.isoformat()}|{item.id}"))
+
+
+def decode_cursor(cursor):
+    """Returns (page_number, received_date, id), or (1, None, None) for the first page."""
+    if not cursor:
+        return 1, None, None
+    try:
+        page_number, received_date, item_id = force_str(urlsafe_base64_decode(cursor)).split('|')
+        return int(page_number), datetime.fromisoformat(received_date), int(item_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(items, cursor, per_page):
+    """
+    Returns (page_number, page_items, next_cursor, has_next_page) for a queryset
+    of rows with received_date and id, ordered newest first.
+    Raises InvalidCursor for a cursor that was not made by encode_cursor().
+    """
+    page_number, received_date, item_id = decode_cursor(cursor)
+    if received_date is not None:
+        items = items.filter(
+            Q(received_date__lt=received_date) | Q(received_date=received_date, id__lt=item_id)
+        )
+    # One extra row tells whether there is a next page
+    page_items = list(items[:per_page + 1])
+    has_next_page = len(page_items) > per_page
+    page_items = page_items[:per_page]
+    next_cursor = encode_cursor(page_number + 1, page_items[-1]) if has_next_page else None
+    return page_number, page_items, next_cursor, has_next_page
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 class API_Errors(models.Model):
@@ -29,4 +31,12 @@ class API_Errors_Site(models.Model):
             'task': self.task,
             'error': self.error,
             'execution_date': self.execution_date.strftime('%Y-%m-%d %H:%M:%S')
-        }
\ No newline at end of file
+        }
+
+
+@receiver(post_save, sender='deals.ActiveSale')
+def refresh_feed_no_auth_cache_on_new_sale(sender, instance, created, **kwargs):
+    # A new sale in the feed, rebuild the logged-out feed cache (api/feed_cache.py) once it is committed
+    if created:
+        from .tasks import refresh_feed_no_auth_cache
+        transaction.on_commit(lambda: refresh_feed_no_auth_cache.delay())
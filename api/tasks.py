@@ -21,3 +21,23 @@ def send_new_recommendation_email(store_name):
             task="send_new_recommendation_email",
             error=f"Failed to send recommendation email for '{store_name}'. Error: {str(e)}"
         )
+
+@shared_task(ignore_result=True)
+def refresh_feed_no_auth_cache():
+    """
+    Starts a new generation of the logged-out feed cache (api/feed_cache.py) and
+    builds the preview pages, so a cold app launch finds them ready.
+    Queued when a new sale enters the feed, see the receiver in api/models.py.
+    """
+    from . import feed_cache
+    from .IOS_v2_views import build_feed_no_auth
+
+    try:
+        feed_cache.invalidate()
+        for data in feed_cache.PREVIEW_REQUESTS:
+            feed_cache.set_page(data, build_feed_no_auth(data))
+    except Exception as e:
+        API_Errors_Site.objects.create(
+            task="refresh_feed_no_auth_cache",
+            error=str(e)[:255]
+        )
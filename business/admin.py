@@ -1,12 +1,13 @@
 from django.contrib import admin
 from django.utils import timezone
 
-from .models import BusinessProfile, BusinessLoginCode, SaleMessage, GroqAPIData, EditProfileRequest
+from .models import BusinessProfile, BusinessLoginCode, SaleMessage, GroqAPIData, EditProfileRequest, ModerationVerdict
 
 admin.site.register(BusinessProfile)
 admin.site.register(BusinessLoginCode)
 admin.site.register(GroqAPIData)
 admin.site.register(EditProfileRequest)
+admin.site.register(ModerationVerdict)
 
 # Register your models here.
 
@@ -15,7 +16,7 @@ admin.site.register(EditProfileRequest)
 def make_public_ready(modeladmin, request, queryset):
     # When a message is marked public ready, it implies it has been reviewed
     # and no longer needs manual review. Also set sent_at for tracking.
-    queryset.update(publicReady=True, needsManualReview=False, isReviewed=True, sent_at=timezone.now())
+    queryset.update(publicReady=True, needsManualReview=False, isReviewed=True, sent_at=timezone.now(), dispatch_status=SaleMessage.DISPATCH_SENT)
     modeladmin.message_user(request, f"{queryset.count()} messages marked as Public Ready.")
 
 @admin.action(description='Mark selected messages for Manual Review')
@@ -62,7 +63,7 @@ class SaleMessageAdmin(admin.ModelAdmin):
         'store__name',  # Allows searching by store name
         'created_by__email', # Allows searching by creator's email
     )
-    readonly_fields = ('created_at', 'sent_at',) # These fields are set automatically or upon action
+    readonly_fields = ('created_at', 'sent_at', 'dispatch_status',) # These fields are set automatically or upon action
     fieldsets = (
         (None, {
             'fields': ('title', 'grabber', 'description', 'link')
@@ -72,7 +73,7 @@ class SaleMessageAdmin(admin.ModelAdmin):
             'description': 'Current moderation and publication status of the message.'
         }),
         ('Scheduling & Publication', {
-            'fields': ('scheduled_at', 'sent_at'),
+            'fields': ('scheduled_at', 'sent_at', 'dispatch_status'),
             'description': 'When the message is planned to be sent or was actually sent.'
         }),
         ('Origin', {
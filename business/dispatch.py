@@ -0,0 +1,174 @@
+"""
+Publish-time scheduling of SaleMessage pushes.
+
+When a message is saved as publicReady and not yet sent, sync_dispatch()
+queues the send_sale_message task with eta=scheduled_at (or right away). An
+edit that changes the send time revokes the queued task and queues a new one;
+an edit that takes the message back into review, or a delete, revokes it.
+
+Messages further away than DISPATCH_HORIZON are not queued yet: the Redis
+broker redelivers eta tasks after its visibility timeout, so they are picked
+up by the reconciliation sweep (disperse_sales) once they come close. The sweep
+also sends anything that is due but was missed, e.g. after a queryset
+.update() that sent no signal.
+
+Revoking is best effort, so a message is only sent after claiming it: the
+row is locked with SELECT ... FOR UPDATE SKIP LOCKED and moved from 'queued'
+to 'sending' in the transaction that puts its push in the outbox. Every message
+is queued exactly once, whichever task or sweep gets there first, and sweeps
+on several workers split the due messages between them. The outbox moves the
+message on to 'sent' or 'failed' (see the PushOutbox receiver in
+business/models.py).
+"""
+from datetime import timedelta
+
+from celery import current_app
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from business.models import SaleMessage
+from deals.push_outbox import enqueue_push
+
+DISPATCH_HORIZON = timedelta(minutes=30)  # stay well within the broker visibility timeout (1 hour)
+ETA_TOLERANCE = timedelta(seconds=5)  # a task may fire slightly before its eta
+CLAIM_BATCH_SIZE = 20
+
+
+def queuePushNotifications(message: SaleMessage) -> bool:
+    """
+    Queues a push notification in the outbox for the users who have subscribed to the store.
+    Call it in the transaction that marks the message as sent. Returns False when
+    there was nobody to send to.
+    """
+
+    if message.store:
+        store = message.store
+        subscribers = store.subscriptions.filter(email = "support@saledrop.app")
+
+        device_expo_tokens = list(
+            subscribers.prefetch_related('devices')
+            .filter(devices__expo_token__isnull=False)
+            .exclude(devices__expo_token='')
+            .values_list('devices__expo_token', flat=True)
+        )
+        emoji = "🔥"  # Fire emoji for sales
+        if device_expo_tokens:
+            title = store.name
+            subtitle = f"{emoji} {message.title}"
+            grabber = message.grabber if message.grabber != 'N/A' else "Nieuwe deal beschikbaar!"
+            body = grabber
+            data = {
+                "page": "SaleDetail",
+                "analysisId": -message.id,
+            }
+            enqueue_push(f"salemessage:{message.id}", title, subtitle, body, data, tokens=device_expo_tokens)
+            return True
+    return False
+
+
+def _revoke(task_id):
+    if task_id:
+        current_app.control.revoke(task_id)
+
+
+def sync_dispatch(sale_message_id):
+    """
+    Makes the queued send task of a message match its current state, see the
+    module docstring. Called after every commit that saved the message.
+    """
+    message = SaleMessage.objects.filter(id=sale_message_id).first()
+    if message is None:
+        return
+    now = timezone.now()
+
+    should_send = message.publicReady and message.dispatch_status == SaleMessage.DISPATCH_QUEUED
+    if not should_send or (message.scheduled_at and message.scheduled_at > now + DISPATCH_HORIZON):
+        if message.dispatch_task_id:
+            _revoke(message.dispatch_task_id)
+            SaleMessage.objects.filter(id=message.id).update(dispatch_task_id=None, dispatch_eta=None)
+        return
+
+    if message.dispatch_task_id and message.dispatch_eta == message.scheduled_at:
+        return  # already queued for this time
+
+    from business.tasks import send_sale_message
+    _revoke(message.dispatch_task_id)
+    eta = message.scheduled_at if message.scheduled_at and message.scheduled_at > now else None
+    result = send_sale_message.apply_async((message.id,), eta=eta)
+    SaleMessage.objects.filter(id=message.id).update(dispatch_task_id=result.id, dispatch_eta=message.scheduled_at)
+
+
+def cancel_dispatch(task_id):
+    _revoke(task_id)
+
+
+def _due_messages(now):
+    return SaleMessage.objects.filter(
+        Q(scheduled_at__isnull=True) | Q(scheduled_at__lte=now + ETA_TOLERANCE),
+        publicReady=True,
+        dispatch_status=SaleMessage.DISPATCH_QUEUED,
+    )
+
+
+def _send_claimed(message, now):
+    """queued -> sending, or straight to sent when there is nobody to notify. Runs in the claiming transaction."""
+    has_push = queuePushNotifications(message)
+    SaleMessage.objects.filter(id=message.id).update(
+        dispatch_status=SaleMessage.DISPATCH_SENDING if has_push else SaleMessage.DISPATCH_SENT,
+        sent_at=now,
+        dispatch_task_id=None,
+    )
+
+
+def dispatch_sale_message(sale_message_id) -> bool:
+    """
+    Claims one due message and puts its push in the outbox, in one transaction.
+    Returns False when the message is not due, already claimed or already sent.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # No select_related: on MariaDB that would lock the store row as well
+        message = _due_messages(now).select_for_update(skip_locked=True).filter(id=sale_message_id).first()
+        if message is None:
+            return False
+        _send_claimed(message, now)
+    return True
+
+
+def dispatch_due_messages(batch_size=CLAIM_BATCH_SIZE) -> int:
+    """
+    Claims and sends due messages in batches until none are left. Safe to run
+    on several workers at once, each batch skips the rows locked by others.
+    Returns the number of sent messages.
+    """
+    sent = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(
+                _due_messages(now).select_for_update(skip_locked=True)
+                .order_by('scheduled_at', 'created_at')[:batch_size]
+            )
+            for message in messages:
+                _send_claimed(message, now)
+        if not messages:
+            return sent
+        sent += len(messages)
+
+
+def reconcile_dispatches() -> int:
+    """
+    The fallback sweep: sends the due messages that were missed and queues the
+    ones that came within DISPATCH_HORIZON. Returns the number of sent messages.
+    """
+    sent = dispatch_due_messages()
+
+    now = timezone.now()
+    pending = SaleMessage.objects.filter(publicReady=True, dispatch_status=SaleMessage.DISPATCH_QUEUED)
+    upcoming_ids = pending.filter(
+        scheduled_at__gt=now, scheduled_at__lte=now + DISPATCH_HORIZON, dispatch_task_id__isnull=True
+    ).values_list('id', flat=True)
+    for sale_message_id in list(upcoming_ids):
+        sync_dispatch(sale_message_id)
+    return sent
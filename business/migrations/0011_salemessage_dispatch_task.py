@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0010_salemessageclick'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salemessage',
+            name='dispatch_task_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='salemessage',
+            name='dispatch_eta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
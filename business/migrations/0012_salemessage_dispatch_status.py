@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+def mark_sent_messages(apps, schema_editor):
+    SaleMessage = apps.get_model('business', 'SaleMessage')
+    SaleMessage.objects.filter(sent_at__isnull=False).update(dispatch_status='sent')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0011_salemessage_dispatch_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salemessage',
+            name='dispatch_status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='salemessage',
+            index=models.Index(fields=['dispatch_status', 'scheduled_at'], name='salemessage_dispatch_due'),
+        ),
+        migrations.RunPython(mark_sent_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0012_salemessage_dispatch_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('is_safe', models.BooleanField()),
+                ('reason', models.TextField()),
+                ('category', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business', '0013_moderationverdict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salemessage',
+            name='moderation_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
-from django.db.models.signals import pre_delete
+from django.db import transaction
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
@@ -52,7 +53,29 @@ class SaleMessage(models.Model):
                                         help_text="If null, send immediately. If set, send at this time.")
     sent_at = models.DateTimeField(null=True, blank=True, 
                                    help_text="Timestamp of when this was successfully sent.")
+    # Set while a worker moderates the message, see business/moderation.py
+    moderation_lease_until = models.DateTimeField(null=True, blank=True)
+    # Send state, see business/dispatch.py: queued -> sending (claimed, push in the outbox) -> sent / failed
+    DISPATCH_QUEUED = 'queued'
+    DISPATCH_SENDING = 'sending'
+    DISPATCH_SENT = 'sent'
+    DISPATCH_FAILED = 'failed'
+    DISPATCH_STATUS_CHOICES = [
+        (DISPATCH_QUEUED, 'Queued'),
+        (DISPATCH_SENDING, 'Sending'),
+        (DISPATCH_SENT, 'Sent'),
+        (DISPATCH_FAILED, 'Failed'),
+    ]
+    dispatch_status = models.CharField(max_length=10, choices=DISPATCH_STATUS_CHOICES, default=DISPATCH_QUEUED)
+    # Queued send task
+    dispatch_task_id = models.CharField(max_length=255, null=True, blank=True)
+    dispatch_eta = models.DateTimeField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['dispatch_status', 'scheduled_at'], name='salemessage_dispatch_due'),
+        ]
+
     def __str__(self):
         return f"{self.store.name} - {self.title}"
 
@@ -65,6 +88,37 @@ def delete_related_groq_data(sender, instance, **kwargs):
     if hasattr(instance, 'groq_data'):
         instance.groq_data.delete()
 
+@receiver(post_save, sender=SaleMessage)
+def schedule_sale_message_dispatch(sender, instance, **kwargs):
+    """
+    (Re)schedules the send task once the save is committed, see business/dispatch.py.
+    """
+    from business.dispatch import sync_dispatch
+    sale_message_id = instance.pk
+    transaction.on_commit(lambda: sync_dispatch(sale_message_id))
+
+@receiver(post_save, sender='deals.PushOutbox')
+def finish_sale_message_dispatch(sender, instance, **kwargs):
+    """
+    Moves a 'sending' SaleMessage to sent / failed once the outbox has delivered
+    or given up on its push.
+    """
+    if not instance.idempotency_key.startswith('salemessage:'):
+        return
+    status_map = {'sent': SaleMessage.DISPATCH_SENT, 'failed': SaleMessage.DISPATCH_FAILED}
+    if instance.status in status_map:
+        SaleMessage.objects.filter(
+            id=int(instance.idempotency_key.split(':', 1)[1]),
+            dispatch_status=SaleMessage.DISPATCH_SENDING
+        ).update(dispatch_status=status_map[instance.status])
+
+@receiver(post_delete, sender=SaleMessage)
+def cancel_sale_message_dispatch(sender, instance, **kwargs):
+    from business.dispatch import cancel_dispatch
+    task_id = instance.dispatch_task_id
+    if task_id:
+        transaction.on_commit(lambda: cancel_dispatch(task_id))
+
     
 class SaleMessageClick(models.Model):
     salemessage = models.ForeignKey(SaleMessage, 
@@ -86,6 +140,22 @@ class GroqAPIData(models.Model):
     category = models.CharField(max_length=100)
     moderated_at = models.DateTimeField(auto_now_add=True)
 
+class ModerationVerdict(models.Model):
+    """
+    Groq verdicts keyed on the normalized title/grabber/description and the
+    prompt version, so re-submitted texts are not moderated again.
+    See business/moderation_cache.py.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    is_safe = models.BooleanField()
+    reason = models.TextField()
+    category = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key[:12]}... {self.category} ({self.hits} hits)"
+
 class BusinessLoginCode(models.Model):
     email = models.EmailField(db_index=True)
     code = models.CharField(max_length=6)
@@ -0,0 +1,367 @@
+"""
+Groq moderation of SaleMessages.
+
+moderate_messages() first tries the local rules (business/moderation_rules.py)
+and the verdict cache (business/moderation_cache.py); only the remaining,
+ambiguous messages go to Groq, with one client for the whole run and at most
+MODERATION_CONCURRENCY requests in flight, paced by a shared rate limiter
+(GROQ_REQUESTS_PER_MINUTE). Messages linking outside the store's own domains
+skip the cache and Groq sees their link. apply_moderation_results() stores the
+verdicts with bulk writes. The API key is loaded on first use, so importing
+this module does not touch the database.
+
+Messages are claimed before they are moderated (claim_for_moderation): a
+moderation lease (SaleMessage.moderation_lease_until) is set under SELECT ...
+FOR UPDATE SKIP LOCKED, so the per-message task and the periodic sweep never
+pay for the same message twice. A verdict is only stored when the text is
+still the one that was moderated; an edit in the meantime has queued its own
+moderation.
+"""
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+from groq import Groq, RateLimitError, APIConnectionError, AuthenticationError, GroqError
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from business.models import SaleMessage, GroqAPIData
+from deals.models import GmailToken, ScrapeData
+from deals.worker_pool import get_rate_limiter, run_in_threads
+from business.moderation_rules import check_message, has_foreign_link
+from business.moderation_cache import make_cache_key, get_cached_verdict, store_verdict, evict
+
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+SYSTEM_PROMPT = """
+    You are a content moderation assistant. Brands can upload messages about sales and deals. I don't want any inappropriate content to be posted.
+
+    Check for:
+    - Weird/spammy content
+    - Harassment or bullying
+    - Hate speech or discrimination
+    - Violence or threats
+    - Sexual content
+    - Scams or phishing attempts
+    - Misinformation with harmful intent
+
+    Respond ONLY with valid JSON in this exact format:
+    {
+        "is_safe": true/false,
+        "reason": "brief explanation in dutch language",
+        "category": "safe/spam/harassment/hate_speech/violence/sexual/scam/other"
+    }
+"""
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_groq_api_key() -> str:
+    """The Groq key from the GmailToken named "Groq", or the GROQ_API_KEY environment variable."""
+    token = GmailToken.objects.filter(name="Groq").first()
+    if token and (token.token_json or {}).get('API_key'):
+        return token.token_json['API_key']
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("Groq API key must be stored as GmailToken 'Groq' or set in GROQ_API_KEY environment variable")
+    return api_key
+
+
+def get_groq_client():
+    """Process-wide Groq client, created on first use and reused by all threads."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Groq(api_key=get_groq_api_key())
+    return _client
+
+
+def _create_fallback_response(reason: str, category: str = "error") -> dict:
+    """Creates a standardized error response."""
+    return {
+        "is_safe": False,  # Default to unsafe on error
+        "reason": reason,
+        "category": category,
+        "failed": True,
+    }
+
+
+def format_sale_message(message: SaleMessage, include_link=False) -> str:
+    text = f"Title: {message.title}\nGrabebr: {message.grabber}\nDescription: {message.description}"
+    if include_link:
+        text += f"\nLink: {message.link}"
+    return text
+
+
+def moderate_message(
+    message: str,
+    client=None,
+    max_retries: int = 3,
+    initial_backoff: float = 1.0
+) -> dict:
+    """
+    Moderates a user message to check for spam and inappropriate content with retries.
+
+    Args:
+        message: The user message to moderate.
+        client: Groq client to use, defaults to get_groq_client().
+        max_retries: The maximum number of times to retry the API call.
+        initial_backoff: The initial wait time in seconds for the first retry.
+
+    Returns:
+        dict with keys:
+            - is_safe (bool): True if message is okay, False if it should be blocked.
+            - reason (str): Explanation of the decision.
+            - category (str): Category of issue if unsafe.
+            - failed (bool, only on errors): the service gave no verdict.
+    """
+    try:
+        client = client or get_groq_client()
+    except Exception as e:
+        return _create_fallback_response(f"Client initialization error: {e}", "config_error")
+
+    limiter = get_rate_limiter('groq', settings.GROQ_REQUESTS_PER_MINUTE)
+    response_text_for_debugging = "" # Store last response text for error printing
+    for attempt in range(max_retries):
+        try:
+            limiter.acquire()
+            chat_completion = client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": f"Moderate this message: {message}"}
+                ],
+                model=GROQ_MODEL,
+                temperature=1.0,
+                max_tokens=150,
+                response_format={"type": "json_object"}  # Enforce JSON output
+            )
+
+            # Check for empty response
+            if not chat_completion.choices or not chat_completion.choices[0].message.content:
+                print(f"WARNING: API returned an empty response (Attempt {attempt + 1})")
+                raise GroqError("Empty response from API") # Trigger a retry
+
+            response_text_for_debugging = chat_completion.choices[0].message.content
+            result = json.loads(response_text_for_debugging)
+
+            # Validate the structure and types
+            if not (
+                isinstance(result.get("is_safe"), bool) and
+                isinstance(result.get("reason"), str) and
+                isinstance(result.get("category"), str)
+            ):
+                print(f"WARNING: API returned malformed JSON structure: {result} (Attempt {attempt + 1})")
+                raise ValueError("Invalid response format from API") # Trigger a retry
+
+            return result
+
+        except AuthenticationError as e:
+            print(f"ERROR: Authentication error: {e}. Check your API key.")
+            return _create_fallback_response("Invalid API key", "auth_error") # Non-recoverable
+
+        except RateLimitError as e:
+            # Other processes share the quota; back off and try again
+            print(f"WARNING: Rate limit hit (Attempt {attempt + 1}/{max_retries}): {e}")
+
+        except (APIConnectionError, GroqError) as e:
+            print(f"WARNING: Transient API error (Attempt {attempt + 1}/{max_retries}): {e}")
+
+        except (json.JSONDecodeError, ValueError) as e:
+            # ValueError is for our custom validation failure
+            print(f"WARNING: Failed to parse/validate API response (Attempt {attempt + 1}/{max_retries}): {e}")
+            print(f"DEBUG: Raw response was: {response_text_for_debugging}")
+
+        except Exception as e:
+            print(f"ERROR: An unexpected error occurred (Attempt {attempt + 1}/{max_retries}): {e}")
+
+        if attempt < max_retries - 1:
+            sleep_time = initial_backoff * (2 ** attempt)
+            print(f"INFO: Retrying in {sleep_time:.2f} seconds...")
+            time.sleep(sleep_time)
+
+    print(f"ERROR: Failed to moderate message after {max_retries} attempts.")
+    return _create_fallback_response("Moderation service failed after multiple retries", "api_failure")
+
+
+def moderate_messages(messages, concurrency=None) -> list:
+    """
+    Moderates SaleMessages: rules first, then the verdict cache, then Groq
+    concurrently with one shared client for the rest.
+    Returns [(message, result)] in the order of `messages`.
+    """
+    messages = list(messages)
+    if not messages:
+        return []
+    concurrency = concurrency or settings.MODERATION_CONCURRENCY
+
+    results = {}
+    keys = {}
+    foreign_link_ids = set()
+    for message in messages:
+        verdict = check_message(message) if settings.MODERATION_RULES_ENABLED else None
+        if verdict is None and settings.MODERATION_RULES_ENABLED and has_foreign_link(message):
+            # The cache key is the text alone, so a link outside the store's domains
+            # always gets its own Groq call, which sees the link
+            foreign_link_ids.add(message.id)
+            keys[message.id] = f"link:{message.id}"
+        elif verdict is None:
+            keys[message.id] = make_cache_key(message)
+            verdict = get_cached_verdict(keys[message.id])
+        if verdict is not None:
+            results[message.id] = verdict
+
+    # Identical texts in one batch only need one call
+    to_moderate = {}
+    for message in messages:
+        if message.id not in results:
+            to_moderate.setdefault(keys[message.id], message)
+
+    if to_moderate:
+        try:
+            client = get_groq_client()
+        except Exception as e:
+            failure = _create_fallback_response(f"Client initialization error: {e}", "config_error")
+            groq_results = [failure] * len(to_moderate)
+        else:
+            groq_results = run_in_threads(
+                lambda message: moderate_message(
+                    format_sale_message(message, include_link=message.id in foreign_link_ids), client=client
+                ),
+                to_moderate.values(),
+                max_workers=concurrency,
+            )
+        verdict_by_key = dict(zip(to_moderate, groq_results))
+        for key, message in to_moderate.items():
+            if message.id not in foreign_link_ids:
+                store_verdict(key, verdict_by_key[key])
+        evict()
+        for message in messages:
+            if message.id not in results:
+                results[message.id] = verdict_by_key[keys[message.id]]
+
+    return [(message, results[message.id]) for message in messages]
+
+
+def claim_for_moderation(ids=None, limit=None) -> list:
+    """
+    Claims unreviewed messages without an active moderation lease, optionally
+    only `ids`, and gives them a lease of MODERATION_LEASE_SECONDS.
+    Returns the claimed messages.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimable = SaleMessage.objects.select_for_update(skip_locked=True).filter(
+            Q(moderation_lease_until__isnull=True) | Q(moderation_lease_until__lt=now),
+            isReviewed=False,
+        )
+        if ids is not None:
+            claimable = claimable.filter(id__in=ids)
+        claimable = claimable.order_by('created_at')
+        messages = list(claimable[:limit] if limit else claimable)
+        lease_until = now + timedelta(seconds=settings.MODERATION_LEASE_SECONDS)
+        SaleMessage.objects.filter(id__in=[message.id for message in messages]).update(moderation_lease_until=lease_until)
+    for message in messages:
+        message.moderation_lease_until = lease_until
+    return messages
+
+
+def moderate_sale_message(sale_message_id) -> bool:
+    """
+    Claims and moderates one message. Returns False when it is already
+    reviewed or being moderated elsewhere.
+    """
+    messages = claim_for_moderation(ids=[sale_message_id])
+    if not messages:
+        return False
+    apply_moderation_results(moderate_messages(messages))
+    return True
+
+
+def apply_moderation_results(moderated) -> dict:
+    """
+    Stores the verdicts of moderate_messages() with bulk writes:
+    - safe: reviewed and publicReady
+    - unsafe: reviewed and flagged for manual review
+    - failed: left unreviewed, flagged for manual review in case the service
+      stays down, and retried by the sweep once the lease has expired
+    Messages that were edited or reviewed while being moderated are skipped.
+    Returns the counts per outcome.
+    """
+    now = timezone.now()
+    counts = {'approved': 0, 'flagged': 0, 'failed': 0, 'skipped': 0}
+    with transaction.atomic():
+        current = SaleMessage.objects.select_for_update().in_bulk([message.id for message, _ in moderated])
+        total = len(moderated)
+        moderated = [
+            (message, result) for message, result in moderated
+            if message.id in current
+            and not current[message.id].isReviewed
+            and make_cache_key(current[message.id]) == make_cache_key(message)
+        ]
+        counts['skipped'] = total - len(moderated)
+        _store_moderation_results(moderated, counts, now)
+    return counts
+
+
+def _store_moderation_results(moderated, counts, now):
+    """Runs in the transaction of apply_moderation_results()."""
+    verdicts = {}
+    for message, result in moderated:
+        if result.get("failed"):
+            message.isReviewed = False
+            message.needsManualReview = True
+            counts['failed'] += 1
+            ScrapeData.objects.create(
+                task="moderation_error",
+                succes=False,
+                major_error=False,
+                error=f"Moderation failed for Message ID {message.id}. Reason: {result.get('reason')}.",
+                execution_date=now
+            )
+            continue
+        if result.get("is_safe") is True:
+            message.isReviewed = True
+            message.publicReady = True
+            message.needsManualReview = False
+            counts['approved'] += 1
+        else:
+            message.isReviewed = True
+            message.publicReady = False
+            message.needsManualReview = True
+            counts['flagged'] += 1
+        message.moderation_lease_until = None
+        verdicts[message.id] = result
+
+    messages = [message for message, _ in moderated]
+    SaleMessage.objects.bulk_update(
+        messages, ['isReviewed', 'publicReady', 'needsManualReview', 'moderation_lease_until'], batch_size=200
+    )
+
+    existing = {data.salemessage_id: data for data in GroqAPIData.objects.filter(salemessage_id__in=list(verdicts))}
+    for message_id, data in existing.items():
+        data.is_safe = verdicts[message_id]["is_safe"]
+        data.reason = verdicts[message_id]["reason"]
+        data.category = verdicts[message_id]["category"]
+    GroqAPIData.objects.bulk_update(list(existing.values()), ['is_safe', 'reason', 'category'], batch_size=200)
+    GroqAPIData.objects.bulk_create([
+        GroqAPIData(
+            salemessage_id=message_id,
+            is_safe=result["is_safe"],
+            reason=result["reason"],
+            category=result["category"],
+        )
+        for message_id, result in verdicts.items() if message_id not in existing
+    ], batch_size=200)
+
+    # bulk_update sends no post_save, so schedule the approved messages here
+    from business.dispatch import sync_dispatch
+    for message in messages:
+        if message.publicReady:
+            transaction.on_commit(lambda message_id=message.id: sync_dispatch(message_id))
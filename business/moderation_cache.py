@@ -0,0 +1,56 @@
+"""
+Cache for Groq moderation verdicts (ModerationVerdict).
+
+Brands often re-submit the same text after an edit to the link or the send
+date. The key is a hash of the normalized title, grabber and description
+(case, whitespace and unicode forms folded) and the prompt version, so the
+same text reuses the earlier verdict. Service failures are never cached.
+
+Entries expire after MODERATION_CACHE_TTL_DAYS.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from business.models import ModerationVerdict
+from business.moderation_rules import normalize_text
+
+
+def make_cache_key(message) -> str:
+    parts = [normalize_text(value).lower() for value in (message.title, message.grabber, message.description)]
+    raw = f"v{settings.MODERATION_PROMPT_VERSION}\n" + '\n'.join(parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _expiry_date():
+    return timezone.now() - timedelta(days=settings.MODERATION_CACHE_TTL_DAYS)
+
+
+def get_cached_verdict(key):
+    """Returns the cached verdict for `key`, or None when missing or expired."""
+    entry = ModerationVerdict.objects.filter(key=key, created_at__gte=_expiry_date()).first()
+    if entry is None:
+        return None
+    ModerationVerdict.objects.filter(id=entry.id).update(hits=F('hits') + 1)
+    return {"is_safe": entry.is_safe, "reason": entry.reason, "category": entry.category, "source": "cache"}
+
+
+def store_verdict(key, result):
+    if result.get("failed"):
+        return
+    ModerationVerdict.objects.filter(key=key, created_at__lt=_expiry_date()).delete()
+    try:
+        ModerationVerdict.objects.create(
+            key=key, is_safe=result["is_safe"], reason=result["reason"], category=result["category"]
+        )
+    except IntegrityError:
+        # Stored by a concurrent moderation of the same text
+        return
+
+
+def evict():
+    ModerationVerdict.objects.filter(created_at__lt=_expiry_date()).delete()
@@ -0,0 +1,101 @@
+"""
+Local pre-filter for SaleMessage moderation.
+
+check_message() only decides the obviously unsafe cases without calling
+Groq: a blocklisted term (scam, adult content) or a link shortener in the
+text. These are flagged for manual review like any unsafe Groq verdict.
+
+The rules never approve a message: the blocklist can't catch harassment, hate
+speech, threats or misleading claims, so everything else returns None and is
+approved by Groq (or by a cached Groq verdict for the same text).
+
+has_foreign_link() is the URL reputation check against the store's own
+domains. It can only escalate: a message linking elsewhere always goes to Groq.
+"""
+import re
+import unicodedata
+from urllib.parse import urlparse
+
+import tldextract
+
+from business.models import SaleMessage
+
+# Only terms that don't occur in normal sale copy. Ambiguous ones ("nude" tints,
+# "You won't want to miss this", "gratis iPhone hoesje", "Ford Escort") are left to Groq.
+BLOCKLIST = {
+    'scam': [
+        r'bitcoin', r'western union', r'moneygram', r'verifieer (?:je|uw) (?:account|gegevens)',
+        r'verify your account', r'stuur (?:je|uw) (?:wachtwoord|inloggegevens|bankgegevens|pincode)',
+    ],
+    'sexual': [r'porno?', r'naaktfoto\w*', r'onlyfans'],
+}
+BLOCKLIST_PATTERNS = {
+    category: re.compile(r'\b(?:' + '|'.join(terms) + r')\b', re.IGNORECASE)
+    for category, terms in BLOCKLIST.items()
+}
+SHORTENER_DOMAINS = {'bit.ly', 'tinyurl.com', 't.co', 'goo.gl', 'ow.ly', 'is.gd', 'buff.ly', 'cutt.ly', 'rebrand.ly', 'shorturl.at', 't.ly'}
+
+URL_IN_TEXT = re.compile(r'(?:https?://|www\.)\S+|\b[\w-]+\.(?:nl|be|com|net|org|eu|shop|store|info|io|co|ly|me|link)\b(?:/\S*)?', re.IGNORECASE)
+
+
+def normalize_text(text) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text or '').split())
+
+
+def _domain_candidates(url) -> set:
+    host = urlparse(url if '://' in url else f'http://{url}').hostname or ''
+    host = host.lower().removeprefix('www.')
+    extracted = tldextract.extract(host)
+    registered_domain = f"{extracted.domain}.{extracted.suffix}" if extracted.suffix else extracted.domain
+    # No bare domain root: "zalando" would also match zalando.ru
+    return {d for d in (host, registered_domain) if d}
+
+
+def _store_domains(store) -> set:
+    domains = {d.strip().lower() for d in (store.domain_list or []) if isinstance(d, str) and d.strip()}
+    for url in (store.home_url, store.sale_url):
+        if url:
+            domains |= _domain_candidates(url)
+    return domains
+
+
+def has_foreign_link(message: SaleMessage) -> bool:
+    """
+    True when the link, or a URL in the text, points outside the store's own
+    domains (Store.domain_list, home_url, sale_url). Only escalates: such a
+    message skips the verdict cache, which is keyed on the text alone, and
+    Groq gets to see the link.
+    """
+    text = ' '.join(normalize_text(value) for value in (message.title, message.grabber, message.description))
+    urls = URL_IN_TEXT.findall(text) + ([message.link] if message.link else [])
+    if not urls:
+        return False
+    store_domains = _store_domains(message.store)
+    return any(not (_domain_candidates(url) & store_domains) for url in urls)
+
+
+def _verdict(is_safe, reason, category) -> dict:
+    return {"is_safe": is_safe, "reason": reason, "category": category, "source": "rules"}
+
+
+def check_message(message: SaleMessage):
+    """
+    Returns an unsafe verdict dict (same keys as business.moderation.moderate_message)
+    for obvious cases, or None when Groq has to decide.
+    """
+    title = normalize_text(message.title)
+    grabber = normalize_text(message.grabber)
+    description = normalize_text(message.description)
+    text = f"{title} {grabber} {description}"
+
+    for category, pattern in BLOCKLIST_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            return _verdict(False, f"Automatisch afgekeurd: bevat '{match.group(0)}'.", category)
+
+    text_urls = URL_IN_TEXT.findall(text)
+    for url in text_urls + [message.link or '']:
+        if url and _domain_candidates(url) & SHORTENER_DOMAINS:
+            return _verdict(False, "Automatisch afgekeurd: bevat een verkorte link.", 'spam')
+
+    return None
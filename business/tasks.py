@@ -5,14 +5,36 @@ from django.core.management import call_command
 
 @shared_task
 def moderate_created_sale_messages():
+    # Old name of moderate_sale_messages, kept for tasks queued before the rename
+    moderate_sale_messages()
+
+@shared_task
+def moderate_sale_messages():
+    """
+    Periodic sweep for unreviewed messages whose moderation task failed or never ran.
+    """
     try:
         call_command('moderate')
     except Exception as e:
         API_Errors_Site.objects.create(
-            task="moderate_created_sale_messages",
+            task="moderate_sale_messages",
             error=str(e)
         )
 
+@shared_task(ignore_result=True)
+def moderate_sale_message(sale_message_id):
+    """
+    Moderates one SaleMessage, queued when it is created or its text is edited.
+    """
+    from business.moderation import moderate_sale_message as moderate
+    try:
+        moderate(sale_message_id)
+    except Exception as e:
+        API_Errors_Site.objects.create(
+            task="moderate_sale_message",
+            error=f"SaleMessage {sale_message_id}: {str(e)}"
+        )
+
 @shared_task
 def disperse_ready_sale_messages():
     try:
@@ -21,4 +43,18 @@ def disperse_ready_sale_messages():
         API_Errors_Site.objects.create(
             task="disperse_ready_sale_messages",
             error=str(e)
-        )
\ No newline at end of file
+        )
+
+@shared_task(ignore_result=True)
+def send_sale_message(sale_message_id):
+    """
+    Sends one SaleMessage at its scheduled time, queued by business/dispatch.py.
+    """
+    from business.dispatch import dispatch_sale_message
+    try:
+        dispatch_sale_message(sale_message_id)
+    except Exception as e:
+        API_Errors_Site.objects.create(
+            task="send_sale_message",
+            error=f"SaleMessage {sale_message_id}: {str(e)}"
+        )
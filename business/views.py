@@ -12,12 +12,13 @@ from django.contrib.auth.decorators import login_required
 from django.db.models import Count
 from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 from deals.models import Store, Click, ClickNoAuth, GmailSaleAnalysis # Keep GmailSaleAnalysis for best_sales
 from .models import BusinessProfile, BusinessLoginCode, SaleMessage, EditProfileRequest, SaleMessageClick
 from .forms import StoreProfileEditForm, SaleMessageForm # Import SaleMessageForm
-from .tasks import moderate_created_sale_messages
+from .tasks import moderate_sale_message
 from api.models import API_Errors_Site
 from pages.models import StaticContent
 
@@ -788,7 +789,8 @@ def create_sale_message_view(request):
 
         # Check if the user should be shown the limit warning *after* this creation
         show_warning = check_sale_limit_warning(store) # This function is already correct
-        moderate_created_sale_messages.delay()
+        sale_message_id = sale_message.id
+        transaction.on_commit(lambda: moderate_sale_message.delay(sale_message_id))
         return JsonResponse({
             'success': True,
             'message': 'Sale bericht aangemaakt. Wij controleren z.s.m. het bericht.',
@@ -912,6 +914,8 @@ def edit_sale_message_view(request, sale_id):
                 updated_message.isReviewed = False
                 updated_message.isManualReviewed = False
                 updated_message.publicReady = False
+                # A running moderation of the old text may not block the new one
+                updated_message.moderation_lease_until = None
                 message = 'Sale bericht is bijgewerkt en wordt opnieuw beoordeeld.'
             elif 'scheduled_at' in changed_fields and not content_has_changed:
                 # If only the date changed, the message is just updated.
@@ -923,6 +927,8 @@ def edit_sale_message_view(request, sale_id):
             # from the instance, and the default message is used.
 
             updated_message.save()
+            if not updated_message.isReviewed:
+                transaction.on_commit(lambda: moderate_sale_message.delay(updated_message.id))
 
             show_warning = check_sale_limit_warning(store)
 
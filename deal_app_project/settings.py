@@ -233,6 +233,16 @@ SIMPLE_JWT = {
 
 
 
+# Cache
+# Redis as well, in its own database so it can be flushed without touching the Celery queues.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+
 # Celery Configuration
 # This tells Celery to use Redis as the message broker.
 # Make sure your Redis server is running.
@@ -253,17 +263,52 @@ CELERY_TASK_TIME_LIMIT = 300 # 5 minutes (adjust if fetching many emails)
 CELERY_WORKER_CONCURRENCY = 15 # Adjust based on your server resources
 
 
+# Resolving tracking links goes through the proxy and can take up to a minute with retries,
+# so it runs on its own queue with its own worker, e.g.:
+# celery -A deal_app_project worker -Q scrape -c 4
+# Push notifications are sent from the outbox by a separate worker as well, so
+# analysis throughput does not depend on Expo latency:
+# celery -A deal_app_project worker -Q push -c 2
+CELERY_TASK_ROUTES = {
+    'deals.tasks.resolve_sale_url': {'queue': 'scrape'},
+    'deals.tasks.drain_push_outbox_task': {'queue': 'push'},
+    'deals.tasks.flush_push_digests_task': {'queue': 'push'},
+}
+
+
 # Celery Beat Schedule
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
-    'disperse-sales-every-minute': {
+    'disperse-sales-sweep-every-10-minutes': {
         'task': 'business.tasks.disperse_ready_sale_messages',
-        'schedule': crontab(minute='*'),  # Runs every minute
+        # Sale messages are sent by their own eta task (business/dispatch.py), this is the fallback
+        'schedule': crontab(minute='*/10'),
+        'args': (),
+    },
+    'drain-push-outbox-every-minute': {
+        'task': 'deals.tasks.drain_push_outbox_task',
+        'schedule': crontab(minute='*'),  # retries and anything missed after enqueue
+        'args': (),
+    },
+    'flush-push-digests-every-minute': {
+        'task': 'deals.tasks.flush_push_digests_task',
+        'schedule': crontab(minute='*'),
+        'args': (),
+    },
+    'check-push-receipts-every-15-minutes': {
+        'task': 'deals.tasks.check_push_receipts_task',
+        'schedule': crontab(minute='*/15'),
+        'args': (),
+    },
+    'expire-active-sales-every-hour': {
+        'task': 'deals.tasks.expire_active_sales_task',
+        'schedule': crontab(minute=30, hour='*'),
         'args': (),
     },
     'moderate-sale-messages-very-hour': {
         'task': 'business.tasks.moderate_sale_messages',
+        # New and edited messages get their own task (business.tasks.moderate_sale_message), this catches stragglers
         'schedule': crontab(minute=0, hour='*'),  # Runs every hour
         'args': (),
     },
@@ -301,3 +346,38 @@ LOGGING = {
 
 # VARIABLES #
 THRESHOLD_DEAL_PROBABILITY = 0.89
+ACTIVE_SALE_WINDOW_DAYS = 21 # sales shown in the feeds, see deals.models.ActiveSale
+FEED_NO_AUTH_CACHE_SECONDS = 300 # logged-out feed cache (api/feed_cache.py), also rebuilt on every new sale
+FEED_EXTRAS_CACHE_SECONDS = 300 # highlighted sales injected in the "my feed" pages, per user
+
+# Gemini analysis (deals/management/commands/analyse_emails*.py)
+ANALYSE_EMAILS_MAX_ANALYSES = 20 # messages claimed per run
+ANALYSE_EMAILS_CONCURRENCY = 5 # Gemini calls in flight per run
+GEMINI_REQUESTS_PER_MINUTE = 120 # per API key, shared by all threads in a worker process
+GEMINI_PROMPT_VERSION = 1 # bump when the prompt or response schema changes, invalidates the analysis cache
+GEMINI_CACHE_TTL_DAYS = 14
+GEMINI_CACHE_MAX_ENTRIES = 5000
+GEMINI_PROMPT_TOKEN_BUDGET = 4000 # approx. tokens of email content per prompt, see deals/prompt_compaction.py
+
+# Expo push notifications (deals/push.py)
+EXPO_PUSH_CONCURRENCY = 6 # chunks of 100 messages posted in parallel
+
+# Push outbox (deals/push_outbox.py)
+PUSH_OUTBOX_BATCH_SIZE = 50 # rows claimed per worker at a time
+PUSH_OUTBOX_LEASE_SECONDS = 300 # a 'sending' row is retried after this if its worker died
+PUSH_OUTBOX_MAX_ATTEMPTS = 8
+PUSH_OUTBOX_RETRY_DELAY_SECONDS = 30 # doubled per attempt
+PUSH_OUTBOX_MAX_RETRY_DELAY_SECONDS = 3600
+PUSH_OUTBOX_RETENTION_DAYS = 7
+
+# Per-device push coalescing (deals/push_coalescing.py), digest windows are set per user
+PUSH_RATE_LIMIT_PER_DEVICE = 6 # pushes per device per window, the rest is combined into a digest
+PUSH_RATE_LIMIT_WINDOW_MINUTES = 60
+
+# SaleMessage moderation (business/moderation.py)
+GROQ_REQUESTS_PER_MINUTE = 30 # shared by all threads in a worker process
+MODERATION_CONCURRENCY = 4 # Groq calls in flight per run
+MODERATION_RULES_ENABLED = True # reject obvious cases locally, see business/moderation_rules.py
+MODERATION_PROMPT_VERSION = 1 # bump when the prompt changes, invalidates the verdict cache
+MODERATION_CACHE_TTL_DAYS = 90
+MODERATION_LEASE_SECONDS = 300 # a claimed message is moderated again after this if its worker died
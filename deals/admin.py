@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.db.models import Q
 
-from .models import GmailMessage, GmailSaleAnalysis, Store, ScrapeData, SubscriptionData, Url, GmailToken, User, Click, ClickNoAuth
+from .models import GmailMessage, GmailSaleAnalysis, Store, ScrapeData, SubscriptionData, Url, GmailToken, User, Click, ClickNoAuth, ImapSyncState, GeminiAnalysisCache, PushOutbox, ActiveSale
 
 # Register other models without custom admin
 admin.site.register(GmailSaleAnalysis)
@@ -9,6 +9,10 @@ admin.site.register(SubscriptionData)
 admin.site.register(GmailToken)
 admin.site.register(Click)
 admin.site.register(ClickNoAuth)
+admin.site.register(ImapSyncState)
+admin.site.register(GeminiAnalysisCache)
+admin.site.register(PushOutbox)
+admin.site.register(ActiveSale)
 
 
 # --- Store Admin Configuration ---
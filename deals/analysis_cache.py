@@ -0,0 +1,69 @@
+"""
+Cache for Gemini analysis results (GeminiAnalysisCache).
+
+Newsletters are often re-sent, or arrive with the same body in both the general
+and the female inbox. The key is a hash of the cleaned email HTML (whitespace
+normalized), the prompt version and the prompt context, so identical content
+with the same previous deals reuses the stored result.
+
+Entries expire after GEMINI_CACHE_TTL_DAYS and the table is capped at
+GEMINI_CACHE_MAX_ENTRIES rows (oldest entries are evicted first), enforced at
+the end of every analyse_emails run.
+"""
+import hashlib
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from deals.models import GeminiAnalysisCache
+
+WHITESPACE = re.compile(r'\s+')
+# get_previous_deals_prompt() prefixes previous deals with e.g. "3 uur geleden",
+# which would otherwise change the key every minute.
+RELATIVE_TIME = re.compile(r'\d+ (?:seconde|minuut|uur|dag)\w* geleden')
+
+
+def make_cache_key(email_html, prompt_addition, prompt_version) -> str:
+    normalized_html = WHITESPACE.sub(' ', email_html or '').strip()
+    normalized_context = WHITESPACE.sub(' ', RELATIVE_TIME.sub('', prompt_addition or '')).strip()
+    raw = f"v{prompt_version}\n{normalized_context}\n{normalized_html}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _expiry_date():
+    return timezone.now() - timedelta(days=settings.GEMINI_CACHE_TTL_DAYS)
+
+
+def get_cached_analysis(key):
+    """Returns the cached Gemini data for `key`, or None when missing or expired."""
+    entry = GeminiAnalysisCache.objects.filter(key=key, created_at__gte=_expiry_date()).first()
+    if entry is None:
+        return None
+    GeminiAnalysisCache.objects.filter(id=entry.id).update(hits=F('hits') + 1)
+    return entry.result
+
+
+def store_analysis(key, data):
+    GeminiAnalysisCache.objects.filter(key=key, created_at__lt=_expiry_date()).delete()
+    try:
+        GeminiAnalysisCache.objects.create(key=key, result=data)
+    except IntegrityError:
+        # Stored by a concurrent analysis of the same content
+        return
+
+
+def evict():
+    """
+    Deletes expired entries and, above the size limit, the oldest ones.
+    Called once per analyse_emails run, not per stored result.
+    """
+    GeminiAnalysisCache.objects.filter(created_at__lt=_expiry_date()).delete()
+    # The newest entry past the limit, read from the created_at index instead of a COUNT(*)
+    limit = settings.GEMINI_CACHE_MAX_ENTRIES
+    past_limit = list(GeminiAnalysisCache.objects.order_by('-created_at').values_list('created_at', flat=True)[limit:limit + 1])
+    if past_limit:
+        GeminiAnalysisCache.objects.filter(created_at__lte=past_limit[0]).delete()
@@ -0,0 +1,178 @@
+"""
+Preprocessing of newsletter HTML before it is sent to Gemini.
+
+Marketing emails are often 100-500 KB of nested layout tables and inline CSS.
+slim_email_html() walks the HTML once with the stdlib tokenizer (no tree is
+built) and writes compact text with markdown-style links and images:
+
+- <head>, <style>, <script>, comments and other non-content tags are dropped
+- hidden elements (preheaders, display:none, max-height:0, ...) are dropped
+- tracking pixels (1x1 images) are dropped
+- layout tables are flattened: rows become lines, cells are joined with spaces
+- all attributes except href / src / alt are discarded
+
+shorten_email_html_bs4() is the previous BeautifulSoup implementation, kept for
+the benchmark_html_slimming command.
+"""
+import re
+from html.parser import HTMLParser
+
+SKIPPED_TAGS = {'head', 'style', 'script', 'title', 'meta', 'link', 'noscript', 'template', 'svg', 'xml', 'o:p'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+BLOCK_TAGS = {
+    'p', 'div', 'table', 'tbody', 'thead', 'tfoot', 'tr', 'ul', 'ol', 'li', 'section', 'article',
+    'header', 'footer', 'center', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'br',
+}
+CELL_TAGS = {'td', 'th'}
+
+HIDDEN_STYLE = re.compile(
+    r'display\s*:\s*none|visibility\s*:\s*hidden|max-height\s*:\s*0(?:px)?\s*(?:;|$|!)'
+    r'|opacity\s*:\s*0(?:\.0+)?\s*(?:;|$|!)',
+    re.IGNORECASE,
+)
+HIDDEN_CLASS = re.compile(r'preheader|preview-?text', re.IGNORECASE)
+PIXEL_SIZES = {'0', '1', '2'}  # width/height of a tracking pixel, compared without 'px'
+SPACES = re.compile(r'[ \t\r\f\v\u00a0\u200b\u200c\u200d\u034f\ufeff]+')
+
+
+def _is_hidden(attrs) -> bool:
+    if 'hidden' in attrs or attrs.get('aria-hidden') == 'true':
+        return True
+    if HIDDEN_STYLE.search(attrs.get('style') or ''):
+        return True
+    return bool(HIDDEN_CLASS.search(attrs.get('class') or ''))
+
+
+def _style_properties(style) -> dict:
+    """Parses an inline style into {property: value}, lowercased, without !important."""
+    properties = {}
+    for declaration in (style or '').split(';'):
+        name, _, value = declaration.partition(':')
+        if value:
+            properties[name.strip().lower()] = value.lower().replace('!important', '').strip()
+    return properties
+
+
+def _pixel_size(value) -> bool:
+    return (value or '').strip().lower().removesuffix('px').strip() in PIXEL_SIZES
+
+
+def _is_tracking_pixel(attrs) -> bool:
+    # Exact style properties: border-width:1px or max-width:0 are not the image size
+    properties = _style_properties(attrs.get('style'))
+    return any(
+        _pixel_size(attrs.get(size)) or _pixel_size(properties.get(size))
+        for size in ('width', 'height')
+    )
+
+
+class _EmailSlimmer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.stack = []  # open tags: (tag, skipped)
+        self.skip_depth = 0  # > 0 while inside a skipped or hidden element
+        self.links = []  # open <a>: (href, index in self.out)
+
+    def _push(self, tag, skipped):
+        self.stack.append((tag, skipped))
+        if skipped:
+            self.skip_depth += 1
+
+    def handle_starttag(self, tag, attrs_list):
+        attrs = {k: (v or '') for k, v in attrs_list}
+        skipped = tag in SKIPPED_TAGS or _is_hidden(attrs)
+
+        if tag in VOID_TAGS:
+            if self.skip_depth or skipped:
+                return
+            if tag == 'img':
+                src = attrs.get('src', '').strip()
+                if src and not _is_tracking_pixel(attrs):
+                    self.out.append(f" ![{attrs.get('alt', '').strip()}]({src}) ")
+            elif tag in BLOCK_TAGS:
+                self.out.append('\n')
+            return
+
+        self._push(tag, skipped)
+        if self.skip_depth:
+            return
+        if tag == 'a':
+            self.links.append((attrs.get('href', '').strip(), len(self.out)))
+        elif tag in BLOCK_TAGS:
+            self.out.append('\n')
+        elif tag in CELL_TAGS:
+            self.out.append(' ')
+
+    def handle_startendtag(self, tag, attrs_list):
+        self.handle_starttag(tag, attrs_list)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Close everything up to the matching open tag; ignore stray end tags.
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, skipped = self.stack.pop()
+            if skipped:
+                self.skip_depth -= 1
+            elif not self.skip_depth:
+                self._close(open_tag)
+            if open_tag == tag:
+                break
+
+    def _close(self, tag):
+        if tag == 'a' and self.links:
+            href, start = self.links.pop()
+            text = SPACES.sub(' ', ''.join(self.out[start:]).replace('\n', ' ')).strip()
+            del self.out[start:]
+            if href and not href.lower().startswith(('javascript:', '#')):
+                self.out.append(f" [{text}]({href}) ")
+            elif text:
+                self.out.append(f" {text} ")
+        elif tag in BLOCK_TAGS:
+            self.out.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.out.append(data)
+
+    def text(self) -> str:
+        lines = []
+        for line in ''.join(self.out).split('\n'):
+            line = SPACES.sub(' ', line).strip()
+            if line and (not lines or line != lines[-1]):
+                lines.append(line)
+        return '\n'.join(lines)
+
+
+def slim_email_html(full_html: str) -> str:
+    """
+    Returns compact text + links of an HTML email, see the module docstring.
+    Plain text emails come out with their whitespace normalized.
+    """
+    if not full_html:
+        return ''
+    parser = _EmailSlimmer()
+    parser.feed(full_html)
+    parser.close()
+    return parser.text()
+
+
+def shorten_email_html_bs4(full_html: str) -> str:
+    """
+    Previous implementation: returns the <body> with style and class attributes removed.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(full_html, "html.parser")
+    body = soup.body
+    if body:
+        for tag in body.find_all(True):
+            if tag.has_attr('style'):
+                del tag['style']
+            if tag.has_attr('class'):
+                del tag['class']
+        return str(body)
+    return full_html
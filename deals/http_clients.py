@@ -0,0 +1,78 @@
+"""
+Shared HTTP sessions per upstream (Gemini, the scraping proxy and Expo push).
+
+Each session keeps a keep-alive connection pool sized for its upstream, so
+analysed emails and push batches reuse TLS connections instead of doing a new
+handshake per request. Sessions are created lazily, so Celery prefork children
+each build their own after the fork.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+GEMINI_TIMEOUT = 30
+PROXY_TIMEOUT = 25
+EXPO_TIMEOUT = 15
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_session(retry_strategy, pool_maxsize) -> requests.Session:
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _get_session(name, factory) -> requests.Session:
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = factory()
+                _sessions[name] = session
+    return session
+
+
+def gemini_session() -> requests.Session:
+    def factory():
+        retry_strategy = Retry(
+            total=5,
+            status_forcelist=[500, 502, 503, 504],
+            backoff_factor=1  # 1s, 2s, 4s, 8s, 16s
+        )
+        return _build_session(retry_strategy, pool_maxsize=settings.ANALYSE_EMAILS_CONCURRENCY)
+    return _get_session('gemini', factory)
+
+
+def proxy_session() -> requests.Session:
+    def factory():
+        retry_strategy = Retry(
+            total=5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            backoff_factor=1
+        )
+        return _build_session(retry_strategy, pool_maxsize=settings.ANALYSE_EMAILS_CONCURRENCY)
+    return _get_session('proxy', factory)
+
+
+def expo_session() -> requests.Session:
+    def factory():
+        # Only retry when the request never reached Expo, a retried POST
+        # after a read error could deliver the same notifications twice.
+        retry_strategy = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=0,
+            backoff_factor=0.5
+        )
+        return _build_session(retry_strategy, pool_maxsize=10)
+    return _get_session('expo', factory)
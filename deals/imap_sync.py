@@ -0,0 +1,187 @@
+"""
+Incremental IMAP sync for the fetch_emails / fetch_emails_F commands.
+
+Instead of listing the whole mailbox with SEARCH ALL on every webhook trigger,
+we remember the highest UID we have processed per mailbox (ImapSyncState) and
+only ask the server for UIDs above it with `UID SEARCH UID n:*`.
+The watermark is reset when the server reports a different UIDVALIDITY.
+
+The new UIDs are then fetched in two batched commands: first only the headers
+needed for deduplication, then the full bodies of the emails we do not have yet.
+"""
+import email
+import re
+from email.utils import parsedate_to_datetime
+
+from django.utils import timezone
+
+from deals.models import ImapSyncState, GmailMessage
+
+HEADER_FIELDS = '(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID DATE SUBJECT FROM)])'
+UID_PATTERN = re.compile(rb'UID (\d+)')
+
+
+def get_sync_state(email_address, folder='inbox') -> ImapSyncState:
+    state, _ = ImapSyncState.objects.get_or_create(mailbox=f"{email_address}/{folder}")
+    return state
+
+
+def _selected_status(mail, item, folder='inbox') -> int:
+    """
+    Returns a status item (UIDVALIDITY, UIDNEXT) of the currently selected folder.
+    imaplib keeps the untagged responses of SELECT, so this costs no round trip
+    unless the server did not send it.
+    """
+    typ, data = mail.response(item)
+    if not data or data[0] is None:
+        typ, data = mail.status(folder, f'({item})')
+        # e.g. [b'"INBOX" (UIDVALIDITY 1)']
+        return int(data[0].decode().rsplit(item, 1)[1].strip(' )'))
+    return int(data[-1])
+
+
+def get_uidvalidity(mail, folder='inbox'):
+    return _selected_status(mail, 'UIDVALIDITY', folder)
+
+
+def get_uidnext(mail, folder='inbox'):
+    return _selected_status(mail, 'UIDNEXT', folder)
+
+
+def search_new_uids(mail, state: ImapSyncState, max_emails=10) -> list:
+    """
+    Returns the UIDs (ints, oldest first) that still need to be fetched.
+
+    - First sync or UIDVALIDITY changed: only the newest `max_emails` messages are
+      returned, the older history is skipped (same as the old SEARCH ALL behaviour).
+      The watermark is set right below them (UIDNEXT - 1 for an empty mailbox).
+    - Otherwise: everything above the watermark, oldest first and capped at
+      `max_emails`, so a backlog is worked off over the next runs without gaps.
+    """
+    uidvalidity = get_uidvalidity(mail)
+
+    if state.uidvalidity != uidvalidity:
+        typ, data = mail.uid('search', None, 'ALL')
+        uids = sorted(int(uid) for uid in data[0].split())[-max_emails:]
+        state.uidvalidity = uidvalidity
+        # Start right below the returned window, or at the end of an empty mailbox,
+        # so the next run searches incrementally even if nothing is saved now
+        state.last_uid = uids[0] - 1 if uids else get_uidnext(mail) - 1
+        return uids
+
+    typ, data = mail.uid('search', None, f'UID {state.last_uid + 1}:*')
+    # 'n:*' always matches the newest message, even when its UID is below n.
+    uids = sorted(int(uid) for uid in data[0].split() if int(uid) > state.last_uid)
+    return uids[:max_emails]
+
+
+def save_watermark(state: ImapSyncState, last_uid):
+    if last_uid and last_uid > state.last_uid:
+        state.last_uid = last_uid
+    state.save()
+
+
+def _uid_set(uids) -> str:
+    return ','.join(str(uid) for uid in uids)
+
+
+def _parse_fetch_response(data) -> dict:
+    """
+    Turns the response of a multi-message `UID FETCH` into {uid: raw_bytes}.
+    The UID item is usually sent before the literal, but servers may also send
+    it after it (in the closing b' UID 123)' line), so both are handled.
+    """
+    result = {}
+    pending = None
+    for item in data or []:
+        if isinstance(item, tuple):
+            match = UID_PATTERN.search(item[0])
+            if match:
+                result[int(match.group(1))] = item[1]
+                pending = None
+            else:
+                pending = item[1]
+        elif isinstance(item, bytes) and pending is not None:
+            match = UID_PATTERN.search(item)
+            if match:
+                result[int(match.group(1))] = pending
+            pending = None
+    return result
+
+
+def fetch_headers(mail, uids) -> dict:
+    """Fetches Message-ID, Date, Subject and From of all `uids` in one command."""
+    if not uids:
+        return {}
+    typ, data = mail.uid('fetch', _uid_set(uids), HEADER_FIELDS)
+    return {
+        uid: email.message_from_bytes(raw)
+        for uid, raw in _parse_fetch_response(data).items()
+    }
+
+
+def fetch_bodies(mail, uids) -> dict:
+    """Fetches the full RFC822 messages of all `uids` in one command."""
+    if not uids:
+        return {}
+    typ, data = mail.uid('fetch', _uid_set(uids), '(UID RFC822)')
+    return {
+        uid: email.message_from_bytes(raw)
+        for uid, raw in _parse_fetch_response(data).items()
+    }
+
+
+def filter_unseen_uids(headers: dict, email_to) -> list:
+    """
+    Returns the UIDs (sorted) whose Message-ID is not yet saved for this inbox,
+    using a single `dedup_key IN (...)` query.
+    Emails without a Message-ID cannot be checked here and are always returned;
+    the caller falls back to the subject/date check for those.
+    """
+    keys = {
+        uid: GmailMessage.make_dedup_key(msg.get('Message-ID', ''), email_to)
+        for uid, msg in headers.items()
+    }
+    known_keys = set(
+        GmailMessage.objects.filter(dedup_key__in=[k for k in keys.values() if k])
+        .values_list('dedup_key', flat=True)
+    )
+    return sorted(uid for uid, key in keys.items() if key is None or key not in known_keys)
+
+
+def fetch_new_messages(mail, uids, email_to) -> tuple:
+    """
+    Header-first pipeline: returns ([(uid, email.message.Message)], last_handled_uid)
+    for the emails in `uids` that are not saved yet, in three round trips (headers,
+    IN query, bodies) regardless of the number of emails.
+
+    last_handled_uid is the highest UID up to which every UID was fetched or found
+    to be saved already, the safe watermark; None when the first one was not.
+    A UID whose fetch returned nothing stops it there and is fetched again next run.
+    """
+    headers = fetch_headers(mail, uids)
+    unseen_uids = filter_unseen_uids(headers, email_to)
+    bodies = fetch_bodies(mail, unseen_uids)
+
+    handled = (set(headers) - set(unseen_uids)) | set(bodies)
+    last_handled_uid = None
+    for uid in sorted(uids):
+        if uid not in handled:
+            break
+        last_handled_uid = uid
+    return [(uid, bodies[uid]) for uid in unseen_uids if uid in bodies], last_handled_uid
+
+
+def parse_received_date(msg):
+    """
+    Returns the aware Date of an email, or now when it is missing or malformed,
+    so one bad header does not stop the batch (and the watermark) for good.
+    """
+    try:
+        received_date = parsedate_to_datetime(msg.get('Date'))
+    except (TypeError, ValueError, IndexError):
+        print(f"WARNING: Invalid Date header {msg.get('Date')!r}, using the current time.")
+        return timezone.now()
+    if timezone.is_naive(received_date):
+        received_date = timezone.make_aware(received_date, timezone.get_current_timezone())
+    return received_date
@@ -4,29 +4,23 @@ from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.db import transaction
 
-from deals.models import GmailMessage, GmailSaleAnalysis, ScrapeData, Url
+from deals.models import GmailMessage, GmailSaleAnalysis, ScrapeData
+from deals.tasks import resolve_sale_url
+from deals.worker_pool import get_rate_limiter, run_in_threads
+from deals.html_slimming import slim_email_html
+from deals.prompt_compaction import compact_email_text
+from deals.analysis_cache import make_cache_key, get_cached_analysis, store_analysis, evict
+from deals.http_clients import gemini_session, GEMINI_TIMEOUT
+from deals.push_outbox import enqueue_push
 
 import os
 import json
 import requests
-from requests.adapters import HTTPAdapter
 from time import sleep
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urlunparse
-from urllib3.util.retry import Retry
 import random
 
 User = get_user_model()
 
-PROXY_CAKE_USERNAME = settings.PROXY_CAKE_USERNAME
-PROXY_CAKE_PASSWORD = settings.PROXY_CAKE_PASSWORD
-PROXY_CAKE_IP = settings.PROXY_CAKE_IP
-PROXY_CAKE_PORT = settings.PROXY_CAKE_PORT
-
-PROXIES = {
-    "http": f"http://{PROXY_CAKE_USERNAME}:{PROXY_CAKE_PASSWORD}@{PROXY_CAKE_IP}:{PROXY_CAKE_PORT}",
-    "https": f"http://{PROXY_CAKE_USERNAME}:{PROXY_CAKE_PASSWORD}@{PROXY_CAKE_IP}:{PROXY_CAKE_PORT}",
-}
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -40,8 +34,6 @@ HEADERS = {
 GEMINI_API_KEY = settings.GEMINI_API_KEY_WOMEN
 GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
 
-EXPO_PUSH_URL = 'https://exp.host/--/api/v2/push/send'
-
 
 deal_types = {
     0: {'emoji': "💸", 'description': "Korting en besparen"},
@@ -55,7 +47,12 @@ deal_types = {
 def analyze_email_with_gemini(email_html, prompt_addition) -> dict:
     """
     Analyseer e-mailinhoud met Gemini API en retourneer data passend bij GmailSaleAnalysis model.
+    Identieke inhoud (met dezelfde prompt context) komt uit de cache, zie deals/analysis_cache.py.
     """
+    cache_key = make_cache_key(email_html, prompt_addition, settings.GEMINI_PROMPT_VERSION)
+    cached_data = get_cached_analysis(cache_key)
+    if cached_data is not None:
+        return {'success': True, 'data': cached_data}
 
     prompt = (
         f"Analyseer de onderstaande e-mailinhoud en bepaal of het een uitverkoop betreft. "
@@ -122,22 +119,13 @@ def analyze_email_with_gemini(email_html, prompt_addition) -> dict:
         }
     }
 
-    # 1. Define the retry strategy
-    retry_strategy = Retry(
-        total=5,  # Total number of retries
-        status_forcelist=[500, 502, 503, 504],  # A set of HTTP status codes to retry on
-        backoff_factor=1  # Will sleep for {backoff factor} * (2 ** ({number of total retries} - 1)) seconds
-                        # e.g., 1s, 2s, 4s, 8s, 16s
-    )
+    session = gemini_session()
 
-    # 2. Create an adapter and mount it to a session
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
+    # Shared budget per API key, also when messages are analysed concurrently
+    get_rate_limiter(GEMINI_API_KEY, settings.GEMINI_REQUESTS_PER_MINUTE).acquire()
 
     try:
-        response = session.post(GEMINI_API_URL, headers=HEADERS, data=json.dumps(payload), timeout=30)
+        response = session.post(GEMINI_API_URL, headers=HEADERS, data=json.dumps(payload), timeout=GEMINI_TIMEOUT)
         response.raise_for_status()
 
     except requests.exceptions.RequestException as e:
@@ -201,134 +189,25 @@ def analyze_email_with_gemini(email_html, prompt_addition) -> dict:
         "deal_type": deal_type,
         "is_new_deal_better": parsed.get("is_new_deal_better", True)
     }
+    store_analysis(cache_key, data)
     return {'success': True, 'data': data}
 
-def scrape_and_save_url(url: str):
-    """
-    Scrapes a URL, handles redirects, strips query parameters, and saves it.
-    This function is designed to be robust, with automatic retries for
-    transient network and server errors.
-    """
-    
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,  # Maximum number of retries
-        status_forcelist=[429, 500, 502, 503, 504],  # Status codes to retry on
-        backoff_factor=1  # Enables exponential backoff (e.g., waits 1s, 2s, 4s...)
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-
-    def strip_query_params(u: str) -> str:
-        parsed = urlparse(u)
-        return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
-
-    # 2. Use a transaction to ensure the database operation is atomic.
-    # This prevents partial data writes if an error occurs.
-    try:
-        with transaction.atomic():
-            clean_url_key = url.strip()
-            if Url.objects.filter(url_ctrk=clean_url_key).exists():
-                return
-
-            # 3. Make the request. The session handles retries automatically.
-            # `raise_for_status()` will raise an HTTPError for non-2xx codes
-            # after all retries are exhausted.
-            response = session.get(
-                clean_url_key, 
-                headers=HEADERS, 
-                proxies=PROXIES, 
-                timeout=25
-            )
-            response.raise_for_status()
-
-            redirected_url = response.url.strip()
-            general_url = strip_query_params(redirected_url)
-
-            Url.objects.create(
-                url_ctrk=clean_url_key,
-                redirected_url=redirected_url,
-                general_url=general_url,
-                last_scraped=timezone.now()
-            )
-
-    # 4. Catch specific exceptions for better error handling.
-    except requests.exceptions.RequestException as e:
-        # This catches connection errors, timeouts, and HTTP errors after retries fail.
-        error_message = f"Network/HTTP error scraping {url}: {str(e)}"
-        ScrapeData.objects.create(
-            task="Scrape General URL",
-            succes=False,
-            major_error=False,
-            error=error_message,
-            execution_date=timezone.now()
-        )
-    except Exception as e:
-        # Catch any other unexpected errors.
-        error_message = f"An unexpected error occurred scraping {url}: {str(e)}"
-        ScrapeData.objects.create(
-            task="Scrape General URL",
-            succes=False,
-            major_error=False,
-            error=error_message,
-            execution_date=timezone.now()
-        )
-
-def sendPushNotifications(analysis: GmailSaleAnalysis, probability_threshold=settings.THRESHOLD_DEAL_PROBABILITY):
+def queuePushNotifications(analysis: GmailSaleAnalysis, probability_threshold=settings.THRESHOLD_DEAL_PROBABILITY):
     """
-    This function sends push notifications to users who have subscribed to the store,
-    respecting the store's gender preference settings.
+    Queues a push notification in the outbox for the users who have subscribed to the store,
+    respecting the store's gender preference settings. Call it in the transaction
+    that creates the analysis.
     """
 
-    def chunk_tokens(token_list, chunk_size=100):
-        """
-        Yields chunks of a list.
-        """
-        for i in range(0, len(token_list), chunk_size):
-            yield token_list[i:i + chunk_size]
-
-    def send_batch_notifications(tokens, title, subtitle, body, data):
+    def subscriber_genders_for_inbox(store, target_email=None):
         """
-        Sends notifications in batches to the Expo Push API.
+        Returns the genders to send to: None for all subscribers, [] for nobody.
         """
-        task_name = "Send Push Notifications"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-        }
-
-        for token_chunk in chunk_tokens(tokens):
-            messages = [{
-                'to': token,
-                'title': title,
-                'subtitle': subtitle,
-                'body': body,
-                'data': data
-            } for token in token_chunk]
-
-            try:
-                response = requests.post(EXPO_PUSH_URL, json=messages, headers=headers)
-                response.raise_for_status()
-                # print("Batch sent:", response.json())
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to send batch: {e}")
-                ScrapeData.objects.create(
-                    task=task_name,
-                    succes=False,
-                    major_error=True,
-                    error=str(e),
-                    execution_date=timezone.now()
-                )
-            else:
-                print("Batch sent successfully.")
-
-    def filter_subscribers_by_store_gender(store, subscribers_queryset, target_email=None):
         if store.genderPreferenceSet:
             if target_email and target_email.lower().strip() == "gijsgprojects@gmail.com":
-                return subscribers_queryset.filter(extrauserinformation__gender__in=[0, 2])
+                return [0, 2]
             elif target_email and target_email.lower().strip() == "donnapatrona79@gmail.com":
-                return subscribers_queryset.filter(extrauserinformation__gender__in=[1, 2])
+                return [1, 2]
             else:
                 # Log unexpected mismatch
                 ScrapeData.objects.create(
@@ -338,35 +217,17 @@ def sendPushNotifications(analysis: GmailSaleAnalysis, probability_threshold=set
                     error=f"Unknown target email for gender-preferenced store: {target_email}",
                     execution_date=timezone.now()
                 )
-                return subscribers_queryset.none()
+                return []
         else:
-            return subscribers_queryset
+            return None
 
     if analysis.is_sale_mail and not analysis.is_personal_deal and analysis.deal_probability > probability_threshold:
-        if analysis.message.store:
+        if analysis.message.store and analysis.is_new_deal_better:
             store = analysis.message.store
-            subscribers = filter_subscribers_by_store_gender(
-                store, store.subscriptions.all(), target_email=analysis.message.email_to
-            )
+            genders = subscriber_genders_for_inbox(store, target_email=analysis.message.email_to)
 
-            expo_tokens = list(
-                subscribers.select_related('extrauserinformation')
-                .filter(extrauserinformation__expoToken__isnull=False)
-                .exclude(extrauserinformation__expoToken='')
-                .values_list('extrauserinformation__expoToken', flat=True)
-            )
-
-            # New method using the Device model
-            device_expo_tokens = list(
-                subscribers.prefetch_related('devices')
-                .filter(devices__expo_token__isnull=False)
-                .exclude(devices__expo_token='')
-                .values_list('devices__expo_token', flat=True)
-            )
-
-            all_tokens = list(set(expo_tokens + device_expo_tokens))
-
-            if all_tokens and analysis.is_new_deal_better:
+            # The tokens are read from the push audience when the outbox is drained
+            if genders != []:
                 title = store.name
                 emoji = deal_types[analysis.deal_type]['emoji']
                 subtitle = f"{emoji} {analysis.title}"
@@ -376,7 +237,7 @@ def sendPushNotifications(analysis: GmailSaleAnalysis, probability_threshold=set
                     "page": "SaleDetail",
                     "analysisId": analysis.id,
                 }
-                send_batch_notifications(all_tokens, title, subtitle, body, data)
+                enqueue_push(f"analysis:{analysis.id}", title, subtitle, body, data, store=store, genders=genders)
 
 def generate_analysis_from_gemini_data(message, data):
 
@@ -391,10 +252,6 @@ def generate_analysis_from_gemini_data(message, data):
 
     data = safe_parse_analysis(data=data)
 
-    if data.get('is_sale_mail') and data.get('main_link'):
-        # scrape the url
-        scrape_and_save_url(url=data.get('main_link'))
-
     if len(data["title"].split()) > 7:
         ScrapeData.objects.create(
             task="Generating analysis from gemini data",
@@ -419,6 +276,12 @@ def generate_analysis_from_gemini_data(message, data):
         is_new_deal_better=data["is_new_deal_better"]
     )
 
+    if data.get('is_sale_mail') and data.get('main_link'):
+        # Resolve the tracking link in the background once the analysis is committed,
+        # the push does not wait for it
+        main_link = data.get('main_link')
+        transaction.on_commit(lambda: resolve_sale_url.delay(main_link))
+
     return analysis
 
 def get_previous_deals_prompt(store, email_to):
@@ -463,34 +326,11 @@ def get_previous_deals_prompt(store, email_to):
 
     return f"De vorige analyses van dezelfde winkel zijn geweest:\n{''.join(prompts)}. Geef aan of in deze mail een nieuwe of een betere deal staat d.m.v. is_new_deal_better = True"
 
-def analyze_gmail_messages(max_analyses=10):
-
-    def shorten_email_html(full_html: str) -> str:
-        """
-        Extract and return only the <body> content from a full HTML email.
-        This removes <head> and other non-body elements to reduce size.
-        """
-        soup = BeautifulSoup(full_html, "html.parser")
-        body = soup.body
-        if body:
-            for tag in body.find_all(True):
-                if tag.has_attr('style'):
-                    del tag['style']
-                if tag.has_attr('class'):
-                    del tag['class']
-
-            if len(str(body)) > 10000:
-                dif = len(str(body)) - len(full_html)
-                print(f"Waarschuwing: E-mail HTML is nog steeds erg lang ({len(str(body))} tekens).\n{dif} tekens zijn verloren")
-
-            return str(body)
-        else:
-            return full_html
-       
-    messages_to_analyse = GmailMessage.objects.filter(analysis__isnull=True).order_by('-received_date')
-    messages_subset = messages_to_analyse[:max_analyses]
-    successfully_analyzed = 0
-
+def analyze_gmail_messages(max_analyses=10, concurrency=1):
+    """
+    Claims up to `max_analyses` unanalysed messages and analyses them with at most
+    `concurrency` Gemini calls in flight. Returns the number of created analyses.
+    """
     with transaction.atomic():
         # Get a list of messages that are not currently locked by another process
         # and lock them for this transaction.
@@ -505,16 +345,14 @@ def analyze_gmail_messages(max_analyses=10):
         message_ids = [msg.id for msg in messages_subset]
         GmailMessage.objects.filter(id__in=message_ids).update(in_analysis=True)
 
-    num_messages = len(messages_subset)
-
-    for i, message in enumerate(messages_subset):
+    def analyse_message(message) -> bool:
         try:
             # Get a prompt addition: introduce the last two 'deals' in the same inbox
             # This will be used to determine if the deal is new 
             
             prompt_addition = get_previous_deals_prompt(message.store, message.email_to)
             
-            cleaned_html_body = shorten_email_html(message.body)
+            cleaned_html_body = compact_email_text(slim_email_html(message.body), settings.GEMINI_PROMPT_TOKEN_BUDGET)
 
             data = None
             error = None
@@ -543,8 +381,13 @@ def analyze_gmail_messages(max_analyses=10):
             if data:
                 analysis = None
                 try:
-                    analysis = generate_analysis_from_gemini_data(message=message, data=data)
+                    # The analysis and its notification are stored together or not at all
+                    with transaction.atomic():
+                        analysis = generate_analysis_from_gemini_data(message=message, data=data)
+                        if analysis:
+                            queuePushNotifications(analysis=analysis)
                 except Exception as e:
+                    analysis = None  # rolled back
                     ScrapeData.objects.create(
                         task = "Error with function 'analyze_email_with_gemini'",
                         succes = False,
@@ -554,8 +397,7 @@ def analyze_gmail_messages(max_analyses=10):
                     )
 
                 if analysis:
-                    sendPushNotifications(analysis=analysis)
-                    successfully_analyzed += 1
+                    return True
 
         except Exception as e:
             ScrapeData.objects.create(
@@ -567,20 +409,50 @@ def analyze_gmail_messages(max_analyses=10):
         finally:
             message.in_analysis = False
             message.save()
-    
-    return successfully_analyzed
+        return False
+
+    def analyse_store_messages(store_messages) -> int:
+        return sum(1 for message in store_messages if analyse_message(message))
+
+    # Every message is claimed by this run only, so they can be analysed in parallel.
+    # Messages of the same store stay sequential, because is_new_deal_better
+    # compares against the previous analyses of that store.
+    messages_by_store = {}
+    for message in messages_subset:
+        messages_by_store.setdefault(message.store_id, []).append(message)
+
+    results = run_in_threads(analyse_store_messages, messages_by_store.values(), max_workers=concurrency)
+    evict()
+    return sum(results)
 
 
 
 class Command(BaseCommand):
     help = 'Analyse gmails with gemini'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-analyses',
+            type=int,
+            default=settings.ANALYSE_EMAILS_MAX_ANALYSES,
+            help='Maximum number of messages to claim and analyse in this run.',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.ANALYSE_EMAILS_CONCURRENCY,
+            help='Number of messages analysed in parallel (1 = one after another).',
+        )
+
     def handle(self, *args, **options):
         execution_date = timezone.now()
         task_name = "Gemini Gmail Analysis"
 
         try:
-            successfully_analyzed = analyze_gmail_messages(max_analyses=10)
+            successfully_analyzed = analyze_gmail_messages(
+                max_analyses=options['max_analyses'],
+                concurrency=options['concurrency'],
+            )
             self.stdout.write(self.style.SUCCESS(f'Successfully analyzed {successfully_analyzed} Gmail messages.'))
         except Exception as e:
             # Log failure with error message
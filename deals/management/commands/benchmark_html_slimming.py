@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from deals.models import GmailMessage
+from deals.html_slimming import slim_email_html, shorten_email_html_bs4
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare output size and time of slim_email_html against the previous BeautifulSoup shorten_email_html.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50, help='Number of most recent Gmail messages to use.')
+        parser.add_argument('--file', action='append', default=[], help='HTML file to use instead of the database (repeatable).')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per function, the fastest run is reported.')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            bodies = []
+            for path in options['file']:
+                with open(path, encoding='utf-8', errors='ignore') as f:
+                    bodies.append(f.read())
+        else:
+            bodies = list(
+                GmailMessage.objects.order_by('-received_date')
+                .values_list('body', flat=True)[:options['limit']]
+            )
+        bodies = [body for body in bodies if body]
+        if not bodies:
+            self.stderr.write(self.style.ERROR('No email bodies to benchmark.'))
+            return
+
+        input_size = sum(len(body) for body in bodies)
+        self.stdout.write(f"{len(bodies)} emails, {input_size / 1024:.0f} KB of HTML in total")
+
+        for name, func in (('bs4 shorten_email_html', shorten_email_html_bs4), ('slim_email_html', slim_email_html)):
+            best = None
+            for _ in range(max(1, options['repeat'])):
+                start = time.perf_counter()
+                outputs = [func(body) for body in bodies]
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            output_size = sum(len(output) for output in outputs)
+            self.stdout.write(
+                f"{name:<24} {best * 1000 / len(bodies):8.1f} ms/email   "
+                f"{output_size / 1024:8.0f} KB out ({output_size / input_size:.1%} of input)"
+            )
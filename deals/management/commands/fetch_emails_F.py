@@ -1,10 +1,9 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from deals.models import GmailMessage, ScrapeData, GmailToken
+from deals.imap_sync import get_sync_state, search_new_uids, save_watermark, fetch_new_messages, parse_received_date
 import imaplib
-import email
 from email.header import decode_header
-from email.utils import parsedate_to_datetime
 from email.utils import parseaddr
 
 
@@ -22,9 +21,9 @@ def fetch_and_save_emails(max_emails=10)->int:
     mail.login(EMAIL_ACCOUNT, APP_PASSWORD)
     mail.select('inbox')  # Select the inbox folder
 
-    # Search emails (ALL = every email)
-    status, data = mail.search(None, 'ALL')
-    mail_ids = list(reversed(data[0].split()))
+    # Only the UIDs above the stored watermark are new
+    sync_state = get_sync_state(gmail_address)
+    new_uids = search_new_uids(mail, sync_state, max_emails=max_emails)
 
     def decode_email_header(header_value):
         decoded_parts = decode_header(header_value)
@@ -86,34 +85,44 @@ def fetch_and_save_emails(max_emails=10)->int:
             'body': html or plain_text,  # prefer HTML if available
         }
 
-    count = 0
-    for num in mail_ids[:max_emails]:
-        status, msg_data = mail.fetch(num, '(RFC822)')
-        
-        # msg_data can contain multiple parts; find the one with the actual email
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                raw_email = response_part[1]
-                msg = email.message_from_bytes(raw_email)
-                data = get_email(msg)
-                
-                # Parse date safely
-                received_date = parsedate_to_datetime(msg.get('Date'))
-                if timezone.is_naive(received_date):
-                    received_date = timezone.make_aware(received_date, timezone.get_current_timezone())
-                
-                # Deduplication & saving
-                if not GmailMessage.objects.filter(subject=data['subject'], received_date=received_date, email_to=gmail_address).exists():
-                    print(f"NEW: Email from {data['sender']} with subject '{data['subject']}'.")
-                    GmailMessage.objects.create(
-                        gmail_message_id=data['gmail_message_id'],
-                        sender = data['sender'] or "Unknown sender",
-                        subject=data['subject'] or "No Subject",
-                        body=data['body'],
-                        received_date=received_date,
-                        email_to=gmail_address
-                    )
-                    count += 1
+    parsed_messages = []
+    # Headers first, bodies only for the emails we do not have yet
+    new_messages, last_handled_uid = fetch_new_messages(mail, new_uids, gmail_address)
+    for uid, msg in new_messages:
+        try:
+            data = get_email(msg)
+        except Exception as e:
+            # Skip this email instead of failing the batch; the watermark still moves past it
+            ScrapeData.objects.create(
+                task='Fetch Gmail Emails',
+                succes=False,
+                major_error=False,
+                error=f"Skipped email UID {uid} in {gmail_address}: {e}",
+                execution_date=timezone.now()
+            )
+            continue
+
+        # A missing or malformed Date falls back to now
+        received_date = parse_received_date(msg)
+
+        # Emails without a Message-ID could not be deduplicated on their headers
+        if not data['gmail_message_id'].strip() and GmailMessage.objects.filter(subject=data['subject'], received_date=received_date, email_to=gmail_address).exists():
+            continue
+
+        print(f"NEW: Email from {data['sender']} with subject '{data['subject']}'.")
+        parsed_messages.append({
+            'gmail_message_id': data['gmail_message_id'],
+            'sender': data['sender'] or "Unknown sender",
+            'subject': data['subject'] or "No Subject",
+            'body': data['body'],
+            'received_date': received_date,
+            'email_to': gmail_address,
+        })
+
+    # Store matching and INSERTs for the whole batch at once
+    count = GmailMessage.objects.ingest_batch(parsed_messages)
+    # Only up to the UIDs that were fetched or already saved, see fetch_new_messages()
+    save_watermark(sync_state, last_handled_uid)
     mail.close()
     mail.logout()
     return count
@@ -122,13 +131,20 @@ def fetch_and_save_emails(max_emails=10)->int:
 class Command(BaseCommand):
     help = 'Fetch and save emails from Gmail using GmailToken model'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-emails',
+            type=int,
+            default=10,
+            help='Maximum number of new emails to fetch in this run (raise it to backfill after downtime).',
+        )
+
     def handle(self, *args, **options):
         task_name = 'Fetch Gmail Emails'
         execution_time = timezone.now()
-        
-        fetch_and_save_emails()
+
         try:
-            count = fetch_and_save_emails()
+            count = fetch_and_save_emails(max_emails=options['max_emails'])
             self.stdout.write(self.style.SUCCESS(f'Emails fetched and saved successfully. Total new: {count}'))
 
         except Exception as e:
@@ -0,0 +1,22 @@
+from deals.models import PushAudience, Store
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed push audience (PushAudience) from the store subscriptions and devices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report stores whose audience differs from the live subscriber tokens')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = 0
+            for store in Store.objects.all().iterator():
+                if set(store.push_tokens_queryset()) != set(store.live_push_tokens_queryset()):
+                    mismatches += 1
+                    self.stdout.write(self.style.WARNING(f"Audience of {store.name} (id {store.id}) is out of date"))
+            self.stdout.write(self.style.SUCCESS(f"Verified push audience, {mismatches} stores out of date."))
+            return
+
+        PushAudience.objects.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Push audience rebuilt: {PushAudience.objects.count()} rows."))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:03
+
+import hashlib
+from django.db import migrations, models
+
+
+def fill_dedup_keys(apps, schema_editor):
+    """
+    Backfills dedup_key for existing emails. Only the first email with a given
+    Message-ID per inbox gets the key, older duplicates keep NULL.
+    """
+    GmailMessage = apps.get_model('deals', 'GmailMessage')
+    seen = set()
+    to_update = []
+    for message in GmailMessage.objects.order_by('id').only('id', 'gmail_message_id', 'email_to').iterator():
+        message_id = (message.gmail_message_id or '').strip()
+        if not message_id:
+            continue
+        key = hashlib.sha256(f"{message.email_to.lower().strip()}\n{message_id}".encode('utf-8')).hexdigest()
+        if key in seen:
+            continue
+        seen.add(key)
+        message.dedup_key = key
+        to_update.append(message)
+    GmailMessage.objects.bulk_update(to_update, ['dedup_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0012_imapsyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gmailmessage',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_dedup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0013_gmailmessage_dedup_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiAnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
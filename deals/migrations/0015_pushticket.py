@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0014_geminianalysiscache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_id', models.CharField(max_length=64, unique=True)),
+                ('expo_token', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_push_audience(apps, schema_editor):
+    Store = apps.get_model('deals', 'Store')
+    PushAudience = apps.get_model('deals', 'PushAudience')
+    Device = apps.get_model('accounts', 'Device')
+    ExtraUserInformation = apps.get_model('accounts', 'ExtraUserInformation')
+
+    store_ids_by_user = {}
+    for store_id, user_id in Store.subscriptions.through.objects.values_list('store_id', 'customuser_id'):
+        store_ids_by_user.setdefault(user_id, []).append(store_id)
+
+    gender_by_user = {}
+    tokens_by_user = {}
+    for user_id, gender, token in ExtraUserInformation.objects.values_list('user_id', 'gender', 'expoToken'):
+        gender_by_user[user_id] = gender
+        if token:
+            tokens_by_user.setdefault(user_id, set()).add(token)
+    for user_id, token in Device.objects.exclude(expo_token='').values_list('user_id', 'expo_token'):
+        tokens_by_user.setdefault(user_id, set()).add(token)
+
+    PushAudience.objects.bulk_create([
+        PushAudience(store_id=store_id, user_id=user_id, gender=gender_by_user.get(user_id), expo_token=token)
+        for user_id, store_ids in store_ids_by_user.items()
+        for store_id in store_ids
+        for token in tokens_by_user.get(user_id, ())
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_extrauserinformation_user'),
+        ('deals', '0015_pushticket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushAudience',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.IntegerField(blank=True, null=True)),
+                ('expo_token', models.CharField(max_length=255)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='push_audience', to='deals.store')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='push_audience', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['store', 'gender'], name='push_audience_store_gender'), models.Index(fields=['expo_token'], name='push_audience_token')],
+                'constraints': [models.UniqueConstraint(fields=('store', 'user', 'expo_token'), name='unique_push_audience_row')],
+            },
+        ),
+        migrations.RunPython(fill_push_audience, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0017_pushoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushDigestItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expo_token', models.CharField(db_index=True, max_length=255)),
+                ('title', models.CharField(max_length=255)),
+                ('subtitle', models.CharField(blank=True, max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('due_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PushDeliveryWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expo_token', models.CharField(max_length=255, unique=True)),
+                ('window_start', models.DateTimeField(db_index=True)),
+                ('sent_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:40
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_active_sales(apps, schema_editor):
+    GmailSaleAnalysis = apps.get_model('deals', 'GmailSaleAnalysis')
+    ActiveSale = apps.get_model('deals', 'ActiveSale')
+
+    analyses = GmailSaleAnalysis.objects.filter(
+        is_sale_mail=True,
+        is_personal_deal=False,
+        deal_probability__gt=settings.THRESHOLD_DEAL_PROBABILITY,
+        is_new_deal_better=True,
+        message__store__isnull=False,
+        message__received_date__gte=timezone.now() - timedelta(days=settings.ACTIVE_SALE_WINDOW_DAYS),
+    ).select_related('message', 'message__store')
+
+    def gender_bucket(store, email_to):
+        if not store.genderPreferenceSet:
+            return 'B'
+        if email_to == "gijsgprojects@gmail.com":
+            return 'M'
+        if email_to == "donnapatrona79@gmail.com":
+            return 'F'
+        return 'U'
+
+    ActiveSale.objects.bulk_create([
+        ActiveSale(
+            analysis_id=analysis.id,
+            store_id=analysis.message.store_id,
+            gender=gender_bucket(analysis.message.store, analysis.message.email_to),
+            received_date=analysis.message.received_date,
+            message_id=analysis.message.id,
+            title=analysis.title,
+            grabber=analysis.grabber,
+            description=analysis.description,
+        )
+        for analysis in analyses
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0018_pushdigestitem_pushdeliverywindow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveSale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female'), ('B', 'Both'), ('U', 'Unknown')], max_length=1)),
+                ('received_date', models.DateTimeField()),
+                ('message_id', models.BigIntegerField()),
+                ('title', models.TextField(blank=True, null=True)),
+                ('grabber', models.TextField(blank=True, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('analysis', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='active_sale', to='deals.gmailsaleanalysis')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_sales', to='deals.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['gender', '-received_date'], name='active_sale_gender_date'), models.Index(fields=['store', 'gender', '-received_date'], name='active_sale_store_gender_date'), models.Index(fields=['received_date'], name='active_sale_received_date')],
+            },
+        ),
+        migrations.RunPython(fill_active_sales, migrations.RunPython.noop),
+    ]
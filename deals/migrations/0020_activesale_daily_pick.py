@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:25
+
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+
+
+def fill_daily_picks(apps, schema_editor):
+    ActiveSale = apps.get_model('deals', 'ActiveSale')
+
+    rows = list(ActiveSale.objects.order_by('-received_date', '-id'))
+    seen_store_days = set()
+    for row in rows:
+        row.received_day = row.received_date.astimezone(dt_timezone.utc).date()
+        row.is_daily_pick = (row.store_id, row.received_day) not in seen_store_days
+        seen_store_days.add((row.store_id, row.received_day))
+    ActiveSale.objects.bulk_update(rows, ['received_day', 'is_daily_pick'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0019_activesale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activesale',
+            name='received_day',
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='activesale',
+            name='is_daily_pick',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(fill_daily_picks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='activesale',
+            name='received_day',
+            field=models.DateField(),
+        ),
+        migrations.AddIndex(
+            model_name='activesale',
+            index=models.Index(fields=['is_daily_pick', '-received_date'], name='active_sale_daily_pick_date'),
+        ),
+        migrations.AddIndex(
+            model_name='activesale',
+            index=models.Index(fields=['store', 'received_day'], name='active_sale_store_day'),
+        ),
+    ]
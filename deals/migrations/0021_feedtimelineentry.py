@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_feed_timelines(apps, schema_editor):
+    Store = apps.get_model('deals', 'Store')
+    ActiveSale = apps.get_model('deals', 'ActiveSale')
+    FeedTimelineEntry = apps.get_model('deals', 'FeedTimelineEntry')
+    ExtraUserInformation = apps.get_model('accounts', 'ExtraUserInformation')
+
+    gender_by_user = dict(ExtraUserInformation.objects.values_list('user_id', 'gender'))
+    user_ids_by_store = {}
+    for store_id, user_id in Store.subscriptions.through.objects.values_list('store_id', 'customuser_id'):
+        user_ids_by_store.setdefault(store_id, []).append(user_id)
+
+    def may_see(gender, bucket):
+        if gender == 0:
+            return bucket in ('M', 'B')
+        if gender == 1:
+            return bucket in ('F', 'B')
+        return True
+
+    rows = []
+    for sale in ActiveSale.objects.all():
+        for user_id in user_ids_by_store.get(sale.store_id, ()):
+            if may_see(gender_by_user.get(user_id), sale.gender):
+                rows.append(FeedTimelineEntry(
+                    user_id=user_id, active_sale_id=sale.id, store_id=sale.store_id, received_date=sale.received_date
+                ))
+    FeedTimelineEntry.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_extrauserinformation_pushdigestminutes'),
+        ('deals', '0020_activesale_daily_pick'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedTimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store_id', models.BigIntegerField()),
+                ('received_date', models.DateTimeField()),
+                ('active_sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='deals.activesale')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_timeline', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-received_date'], name='feed_timeline_user_date'), models.Index(fields=['store_id', 'user'], name='feed_timeline_store_user')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'active_sale'), name='unique_feed_timeline_entry')],
+            },
+        ),
+        migrations.RunPython(fill_feed_timelines, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,72 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.conf import settings
 import tldextract
+import hashlib
 import os
 from django.utils import timezone
+from datetime import timedelta, timezone as dt_timezone
+
+from deals.store_index import match_store_id, invalidate_domain_index, update_store_in_index, remove_store_from_index
 
 # Create your models here.
 User = settings.AUTH_USER_MODEL
 # User = get_user_model() 
 
+class GmailMessageManager(models.Manager):
+    def ingest_batch(self, parsed_messages, batch_size=100) -> int:
+        """
+        Saves a batch of parsed emails (dicts with GmailMessage field names) with a
+        few bulk INSERTs instead of one create() per email.
+
+        Stores are resolved in memory through the domain index, emails whose
+        dedup_key is already saved are skipped, and bulk_create(ignore_conflicts=True)
+        makes an overlapping run a no-op instead of an IntegrityError.
+        Note: save() is not called, so this bypasses any logic in GmailMessage.save().
+
+        Returns the number of new emails.
+        """
+        messages = [self.model(**data) for data in parsed_messages]
+        for message in messages:
+            if not message.dedup_key:
+                message.dedup_key = self.model.make_dedup_key(message.gmail_message_id, message.email_to)
+
+        keys = [m.dedup_key for m in messages if m.dedup_key]
+        seen_keys = set(self.filter(dedup_key__in=keys).values_list('dedup_key', flat=True)) if keys else set()
+
+        new_messages = []
+        for message in messages:
+            if message.dedup_key:
+                if message.dedup_key in seen_keys:
+                    continue
+                seen_keys.add(message.dedup_key)
+            new_messages.append(message)
+
+        if not new_messages:
+            return 0
+
+        matched = {}
+        for message in new_messages:
+            if message.sender and not message.store_id:
+                matched[id(message)] = match_store_id(message.sender_domain_candidates())
+
+        # One query to make sure no matched store was deleted since the index was built
+        existing_store_ids = set(
+            Store.objects.filter(pk__in={sid for sid in matched.values() if sid}).values_list('id', flat=True)
+        )
+        if any(sid and sid not in existing_store_ids for sid in matched.values()):
+            invalidate_domain_index()
+        for message in new_messages:
+            store_id = matched.get(id(message))
+            if store_id in existing_store_ids:
+                message.store_id = store_id
+
+        self.bulk_create(new_messages, batch_size=batch_size, ignore_conflicts=True)
+        return len(new_messages)
+
+
 class GmailMessage(models.Model):
     gmail_message_id = models.CharField(max_length=255)
     sender = models.CharField(max_length=255)
@@ -17,31 +75,62 @@ class GmailMessage(models.Model):
     received_date = models.DateTimeField()
     email_to = models.CharField(max_length=255, blank=False, null=False)
     in_analysis = models.BooleanField(default=False)
+    # sha256 of inbox + Message-ID, used to skip already saved emails before downloading them
+    dedup_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
     store = models.ForeignKey('Store', null=True, blank=False, on_delete=models.SET_NULL)
 
+    @staticmethod
+    def make_dedup_key(message_id, email_to):
+        """
+        Returns the dedup key for a Message-ID header in a given inbox,
+        or None when the email has no Message-ID.
+        """
+        message_id = (message_id or '').strip()
+        if not message_id:
+            return None
+        return hashlib.sha256(f"{email_to.lower().strip()}\n{message_id}".encode('utf-8')).hexdigest()
+
+    objects = GmailMessageManager()
+
+    # Compared by the ActiveSale receiver below, to only re-sync when the store changed
+    TRACKED_FIELDS = ('store_id',)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS}
+        return instance
+
+    def sender_domain_candidates(self) -> list:
+        """
+        Returns the domains of the sender to match against Store.domain_list,
+        most specific first: [full_domain, registered_domain, domain_root].
+        """
+        try:
+            email = self.sender.split('<')[1].split('>')[0].strip()
+        except IndexError:
+            email = self.sender.strip()
+
+        full_domain, registered_domain, domain_root = self.extract_domain_parts_email(email)
+        return [d.lower() for d in [full_domain, registered_domain, domain_root] if d]
+
     def save(self, *args, **kwargs):
+        if not self.dedup_key:
+            self.dedup_key = self.make_dedup_key(self.gmail_message_id, self.email_to)
+
         if self.sender and not self.store:
-            try:
-                email = self.sender.split('<')[1].split('>')[0].strip()
-            except IndexError:
-                email = self.sender.strip()
-            
-            full_domain, registered_domain, domain_root = self.extract_domain_parts_email(email)
-            domain_candidates = [d.lower() for d in [full_domain, registered_domain, domain_root] if d]
-
-            match = None
-            for domain in domain_candidates:
-                for store in Store.objects.all():
-                    if domain in store.domain_list:
-                        match = store
-                        self.store = match
-                        break
+            store_id = match_store_id(self.sender_domain_candidates())
+            if store_id:
+                match = Store.objects.filter(pk=store_id).first()
                 if match:
-                    break
-
+                    self.store = match
+                else:
+                    # Store was deleted by another process since the index was built.
+                    invalidate_domain_index()
 
         super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
 
 
     def extract_domain_parts_email(self, email):
@@ -230,6 +319,45 @@ class Store(models.Model):
     
     def get_subscribers(self):
         return self.subscriptions.all()
+
+    def push_tokens_queryset(self, genders=None):
+        """
+        Distinct Expo tokens of the subscribers of this store, read from the
+        precomputed PushAudience table. `genders` limits it to subscribers with one
+        of those ExtraUserInformation genders (None = all subscribers).
+        """
+        audience = PushAudience.objects.filter(store=self)
+        if genders is not None:
+            audience = audience.filter(gender__in=genders)
+        return audience.values_list('expo_token', flat=True).distinct()
+
+    def live_push_tokens_queryset(self, genders=None):
+        """
+        Same tokens as push_tokens_queryset(), computed from the subscriptions, the
+        Device model and the older ExtraUserInformation.expoToken field as a single
+        UNION query. Used to verify the PushAudience table.
+        """
+        from accounts.models import Device, ExtraUserInformation
+
+        devices = Device.objects.filter(user__subscribed_stores=self).exclude(expo_token='')
+        legacy = ExtraUserInformation.objects.filter(
+            user__subscribed_stores=self, expoToken__isnull=False
+        ).exclude(expoToken='')
+        if genders is not None:
+            devices = devices.filter(user__extrauserinformation__gender__in=genders)
+            legacy = legacy.filter(gender__in=genders)
+
+        # UNION (not UNION ALL) removes tokens present in both places
+        return devices.values_list('expo_token', flat=True).union(
+            legacy.values_list('expoToken', flat=True)
+        )
+
+    def get_push_tokens(self, genders=None) -> list:
+        return list(self.push_tokens_queryset(genders=genders))
+
+    def iter_push_tokens(self, genders=None, chunk_size=2000):
+        """Streams the tokens for stores with very many subscribers, see push_tokens_queryset()."""
+        return self.push_tokens_queryset(genders=genders).iterator(chunk_size=chunk_size)
     
     def delete(self, *args, **kwargs):
         if self.image_url:
@@ -261,6 +389,531 @@ class Store(models.Model):
             'dateIssued': self.dateIssued.strftime('%Y-%m-%d %H:%M:%S') if self.dateIssued else ''
         }
 
+@receiver(post_save, sender=Store)
+def update_domain_index_on_save(sender, instance, **kwargs):
+    """
+    Keeps the in-memory domain index (deals.store_index) in sync when a store
+    is added or edited in the store manager.
+    """
+    update_store_in_index(instance.id, instance.domain_list)
+
+@receiver(post_delete, sender=Store)
+def update_domain_index_on_delete(sender, instance, **kwargs):
+    remove_store_from_index(instance.id)
+
+class ActiveSaleManager(models.Manager):
+    """
+    Keeps ActiveSale in sync with the analyses. Called from the signal handlers
+    below; rows older than ACTIVE_SALE_WINDOW_DAYS are removed by the
+    expire_active_sales_task.
+    """
+
+    def window_start(self):
+        return timezone.now() - timedelta(days=settings.ACTIVE_SALE_WINDOW_DAYS)
+
+    def qualifies(self, analysis) -> bool:
+        """The feed filter: a non-personal, new or better sale with a store, received within the window."""
+        message = analysis.message
+        return bool(
+            analysis.is_sale_mail
+            and not analysis.is_personal_deal
+            and analysis.deal_probability > settings.THRESHOLD_DEAL_PROBABILITY
+            and analysis.is_new_deal_better
+            and message.store_id
+            and message.received_date >= self.window_start()
+        )
+
+    def lock_stores(self, store_ids):
+        """Locks the Store rows of `store_ids` (in id order) until the end of the transaction."""
+        store_ids = sorted({store_id for store_id in store_ids if store_id})
+        list(Store.objects.select_for_update().filter(id__in=store_ids).order_by('id').values_list('id', flat=True))
+
+    @transaction.atomic
+    def sync_analysis(self, analysis):
+        """Adds, updates or removes the row of one analysis, and moves the daily pick of its store."""
+        message = analysis.message
+        qualifies = self.qualifies(analysis)
+        previous = self.filter(analysis_id=analysis.id).values_list('store_id', 'received_day').first()
+        # Writers of a store's rows take turns, see refresh_daily_pick()
+        self.lock_stores([previous[0] if previous else None, message.store_id if qualifies else None])
+        if not qualifies:
+            # The post_delete receiver moves the daily pick
+            self.filter(analysis_id=analysis.id).delete()
+            return
+        received_day = self.model.day_of(message.received_date)
+        self.update_or_create(
+            analysis_id=analysis.id,
+            defaults={
+                'store_id': message.store_id,
+                'gender': self.model.gender_bucket(message.store, message.email_to),
+                'received_date': message.received_date,
+                'received_day': received_day,
+                'message_id': message.id,
+                'title': analysis.title,
+                'grabber': analysis.grabber,
+                'description': analysis.description,
+            }
+        )
+        self.refresh_daily_pick(message.store_id, received_day)
+        if previous and previous != (message.store_id, received_day):
+            self.refresh_daily_pick(*previous)
+
+    @transaction.atomic
+    def refresh_daily_pick(self, store_id, day):
+        """
+        Flags the newest row of a store on `day` as its daily pick, and only that one.
+
+        analyse_emails and analyse_emails_F write sales of the same store from
+        separate processes. Without the store lock each would flag its own row,
+        and the pick is a locking read because under REPEATABLE READ a plain read
+        can miss the row the other process committed while we waited.
+        """
+        self.lock_stores([store_id])
+        rows = self.filter(store_id=store_id, received_day=day)
+        pick_id = rows.select_for_update().order_by('-received_date', '-id').values_list('id', flat=True).first()
+        rows.filter(is_daily_pick=True).exclude(id=pick_id).update(is_daily_pick=False)
+        if pick_id is not None:
+            rows.filter(id=pick_id, is_daily_pick=False).update(is_daily_pick=True)
+
+    def refresh_store(self, store):
+        """
+        Recomputes the gender buckets of a store, e.g. after genderPreferenceSet changed,
+        and the timelines of its subscribers when a bucket changed.
+        """
+        ids_by_bucket = {}
+        for row_id, gender, email_to in self.filter(store=store).values_list('id', 'gender', 'analysis__message__email_to'):
+            bucket = self.model.gender_bucket(store, email_to)
+            if bucket != gender:
+                ids_by_bucket.setdefault(bucket, []).append(row_id)
+        for bucket, ids in ids_by_bucket.items():
+            self.filter(id__in=ids).update(gender=bucket)
+        if ids_by_bucket:
+            FeedTimelineEntry.objects.rebuild_store(store.id)
+
+    def visible_to(self, gender):
+        """
+        Active sales for a user with ExtraUserInformation.gender `gender`, newest first.
+        Add .filter(is_daily_pick=True) for one sale per store per day.
+        """
+        queryset = self.filter(received_date__gte=self.window_start())
+        buckets = self.model.buckets_for(gender)
+        if buckets is not None:
+            queryset = queryset.filter(gender__in=buckets)
+        return queryset.order_by('-received_date', '-id')
+
+    def expire(self) -> int:
+        deleted, _ = self.filter(received_date__lt=self.window_start()).delete()
+        return deleted
+
+
+class ActiveSale(models.Model):
+    """
+    Precomputed feed: one row per analysis that passes the feed filter
+    (ActiveSaleManager.qualifies), with the columns the feeds show, so a feed
+    page is an index range scan on this table instead of a join of
+    GmailSaleAnalysis, GmailMessage and Store.
+    Maintained by the GmailSaleAnalysis / GmailMessage / Store signals below.
+
+    is_daily_pick flags the newest sale of each store per (UTC) day, across
+    all gender buckets, for the feeds that show one sale per store per day.
+    """
+    MALE_INBOX = "gijsgprojects@gmail.com"
+    FEMALE_INBOX = "donnapatrona79@gmail.com"
+
+    GENDER_MALE = 'M'
+    GENDER_FEMALE = 'F'
+    GENDER_BOTH = 'B'
+    GENDER_UNKNOWN = 'U'
+    GENDER_CHOICES = (
+        (GENDER_MALE, 'Male'), # sent to the male inbox of a store with gender preference
+        (GENDER_FEMALE, 'Female'), # sent to the female inbox of a store with gender preference
+        (GENDER_BOTH, 'Both'), # store without gender preference
+        (GENDER_UNKNOWN, 'Unknown'), # store with gender preference, other inbox: only shown to gender 'both'
+    )
+
+    analysis = models.OneToOneField(GmailSaleAnalysis, on_delete=models.CASCADE, related_name='active_sale')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='active_sales')
+    gender = models.CharField(max_length=1, choices=GENDER_CHOICES)
+    received_date = models.DateTimeField()
+    received_day = models.DateField() # UTC date of received_date
+    is_daily_pick = models.BooleanField(default=False) # newest row of this store on received_day
+    message_id = models.BigIntegerField() # GmailMessage id, shown as messageId in the feeds
+    title = models.TextField(null=True, blank=True)
+    grabber = models.TextField(null=True, blank=True)
+    description = models.TextField(null=True, blank=True)
+
+    objects = ActiveSaleManager()
+
+    # The columns of the timeline entries, compared by the FeedTimelineEntry receiver below
+    TRACKED_FIELDS = ('store_id', 'gender', 'received_date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gender', '-received_date'], name='active_sale_gender_date'),
+            models.Index(fields=['store', 'gender', '-received_date'], name='active_sale_store_gender_date'),
+            models.Index(fields=['received_date'], name='active_sale_received_date'),
+            models.Index(fields=['is_daily_pick', '-received_date'], name='active_sale_daily_pick_date'),
+            models.Index(fields=['store', 'received_day'], name='active_sale_store_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_id} [{self.gender}] {self.title}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS}
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+
+    @staticmethod
+    def day_of(received_date):
+        return received_date.astimezone(dt_timezone.utc).date()
+
+    @classmethod
+    def gender_bucket(cls, store, email_to) -> str:
+        if not store.genderPreferenceSet:
+            return cls.GENDER_BOTH
+        if email_to == cls.MALE_INBOX:
+            return cls.GENDER_MALE
+        if email_to == cls.FEMALE_INBOX:
+            return cls.GENDER_FEMALE
+        return cls.GENDER_UNKNOWN
+
+    @classmethod
+    def buckets_for(cls, gender):
+        """The buckets shown to ExtraUserInformation.gender `gender`, None for all."""
+        if gender == 0:
+            return [cls.GENDER_MALE, cls.GENDER_BOTH]
+        if gender == 1:
+            return [cls.GENDER_FEMALE, cls.GENDER_BOTH]
+        return None
+
+def field_changed(instance, name) -> bool:
+    """
+    True when `name` differs from the value loaded from the database (see the
+    from_db() of the models with TRACKED_FIELDS), or when that is unknown.
+    """
+    loaded_values = getattr(instance, '_loaded_values', None)
+    if loaded_values is None or name not in loaded_values:
+        return True
+    return loaded_values[name] != getattr(instance, name)
+
+@receiver(post_save, sender=GmailSaleAnalysis)
+def update_active_sale_on_analysis_save(sender, instance, **kwargs):
+    ActiveSale.objects.sync_analysis(instance)
+
+@receiver(post_delete, sender=ActiveSale)
+def update_daily_pick_on_active_sale_delete(sender, instance, **kwargs):
+    # Also runs for cascades and expired rows
+    if instance.is_daily_pick:
+        ActiveSale.objects.refresh_daily_pick(instance.store_id, instance.received_day)
+
+@receiver(post_save, sender=GmailMessage)
+def update_active_sale_on_message_save(sender, instance, created, **kwargs):
+    # A message can be matched to another store after its analysis was made;
+    # analyse_emails saves every message again, which changes nothing here
+    if created or not field_changed(instance, 'store_id'):
+        return
+    analysis = GmailSaleAnalysis.objects.filter(message=instance).first()
+    if analysis is not None:
+        ActiveSale.objects.sync_analysis(analysis)
+
+@receiver(post_save, sender=Store)
+def update_active_sales_on_store_save(sender, instance, created, **kwargs):
+    if not created:
+        ActiveSale.objects.refresh_store(instance)
+
+class FeedTimelineManager(models.Manager):
+    """
+    Fan-out on write of the ActiveSale rows to the timelines of the subscribers
+    of their store. Called from the signal handlers below, so only the
+    timelines of the users, stores and sales that changed are touched.
+    """
+
+    def _subscriber_genders(self, store_id) -> dict:
+        """Returns {user_id: ExtraUserInformation.gender} for the subscribers of a store."""
+        return dict(
+            Store.subscriptions.through.objects.filter(store_id=store_id)
+            .values_list('customuser_id', 'customuser__extrauserinformation__gender')
+        )
+
+    def _user_genders(self, user_ids) -> dict:
+        from accounts.models import ExtraUserInformation
+
+        genders = {user_id: None for user_id in user_ids}
+        genders.update(ExtraUserInformation.objects.filter(user_id__in=user_ids).values_list('user_id', 'gender'))
+        return genders
+
+    def _entry(self, user_id, sale):
+        return self.model(user_id=user_id, active_sale_id=sale.id, store_id=sale.store_id, received_date=sale.received_date)
+
+    def fan_out(self, sale):
+        """(Re)writes one active sale to the timelines of the subscribers who may see it."""
+        self.filter(active_sale_id=sale.id).delete()
+        self.bulk_create([
+            self._entry(user_id, sale)
+            for user_id, gender in self._subscriber_genders(sale.store_id).items()
+            if ActiveSale.buckets_for(gender) is None or sale.gender in ActiveSale.buckets_for(gender)
+        ], batch_size=1000, ignore_conflicts=True)
+
+    def add_subscriptions(self, store_ids, user_ids):
+        """Backfills the active sales of newly subscribed stores."""
+        sales = list(ActiveSale.objects.filter(store_id__in=store_ids, received_date__gte=ActiveSale.objects.window_start()))
+        if not sales:
+            return
+        rows = []
+        for user_id, gender in self._user_genders(user_ids).items():
+            buckets = ActiveSale.buckets_for(gender)
+            rows.extend(self._entry(user_id, sale) for sale in sales if buckets is None or sale.gender in buckets)
+        self.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+    def remove_subscriptions(self, store_ids, user_ids):
+        self.filter(store_id__in=store_ids, user_id__in=user_ids).delete()
+
+    @transaction.atomic
+    def rebuild_user(self, user_id):
+        """Recomputes the timeline of one user, e.g. after a gender change."""
+        self.filter(user_id=user_id).delete()
+        store_ids = list(Store.objects.filter(subscriptions=user_id).values_list('id', flat=True))
+        self.add_subscriptions(store_ids, [user_id])
+
+    @transaction.atomic
+    def rebuild_store(self, store_id):
+        """Recomputes the entries of one store, e.g. after its gender buckets changed."""
+        self.filter(store_id=store_id).delete()
+        for sale in ActiveSale.objects.filter(store_id=store_id):
+            self.fan_out(sale)
+
+    def for_user(self, user):
+        """The timeline of `user`, newest first: a range read on (user, received_date)."""
+        return self.filter(user=user, received_date__gte=ActiveSale.objects.window_start()).order_by('-received_date', '-id')
+
+    def hydrate(self, entries) -> list:
+        """Returns the ActiveSale rows (with their store) of a page of entries, in one query."""
+        sales = ActiveSale.objects.select_related('store').in_bulk([entry.active_sale_id for entry in entries])
+        return [sales[entry.active_sale_id] for entry in entries if entry.active_sale_id in sales]
+
+
+class FeedTimelineEntry(models.Model):
+    """
+    Precomputed feed per user: one row per (subscriber, active sale of a
+    subscribed store that the subscriber's gender may see), so the "my feed"
+    page is a range read on the user's rows plus one query for the sales.
+    Bounded to the ActiveSale window: rows go with their ActiveSale.
+    Maintained by the ActiveSale, Store.subscriptions and
+    ExtraUserInformation signals below.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_timeline')
+    active_sale = models.ForeignKey(ActiveSale, on_delete=models.CASCADE, related_name='timeline_entries')
+    store_id = models.BigIntegerField() # of active_sale, to drop a store on unsubscribe
+    received_date = models.DateTimeField() # of active_sale, the sort key
+
+    objects = FeedTimelineManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'active_sale'], name='unique_feed_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-received_date'], name='feed_timeline_user_date'),
+            models.Index(fields=['store_id', 'user'], name='feed_timeline_store_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.active_sale_id}"
+
+@receiver(post_save, sender=ActiveSale)
+def update_feed_timelines_on_active_sale_save(sender, instance, created, **kwargs):
+    # Text edits don't change who sees the sale or where
+    if created or any(field_changed(instance, name) for name in ActiveSale.TRACKED_FIELDS):
+        FeedTimelineEntry.objects.fan_out(instance)
+
+@receiver(m2m_changed, sender=Store.subscriptions.through)
+def update_feed_timeline_on_subscription(sender, instance, action, reverse, pk_set, **kwargs):
+    # Same directions as update_push_audience_on_subscription below
+    if action == 'post_add':
+        store_ids, user_ids = (list(pk_set), [instance.pk]) if reverse else ([instance.pk], list(pk_set))
+        FeedTimelineEntry.objects.add_subscriptions(store_ids, user_ids)
+    elif action == 'post_remove':
+        store_ids, user_ids = (list(pk_set), [instance.pk]) if reverse else ([instance.pk], list(pk_set))
+        FeedTimelineEntry.objects.remove_subscriptions(store_ids, user_ids)
+    elif action == 'post_clear':
+        if reverse:
+            FeedTimelineEntry.objects.filter(user_id=instance.pk).delete()
+        else:
+            FeedTimelineEntry.objects.filter(store_id=instance.pk).delete()
+
+@receiver(post_save, sender='accounts.ExtraUserInformation')
+def update_feed_timeline_on_extra_info_save(sender, instance, **kwargs):
+    # The gender decides which sales are in the timeline; token saves on app launch and logout don't
+    if field_changed(instance, 'gender'):
+        FeedTimelineEntry.objects.rebuild_user(instance.user_id)
+
+class PushAudienceManager(models.Manager):
+    """
+    Keeps PushAudience in sync. Called from the signal handlers below, so the
+    rows only change for the users and stores that changed.
+    """
+
+    def _tokens_of_users(self, user_ids) -> dict:
+        """Returns {user_id: (gender, set(tokens))} from Device and ExtraUserInformation."""
+        from accounts.models import Device, ExtraUserInformation
+
+        result = {user_id: (None, set()) for user_id in user_ids}
+        for user_id, gender, token in ExtraUserInformation.objects.filter(user_id__in=user_ids).values_list('user_id', 'gender', 'expoToken'):
+            result[user_id] = (gender, result[user_id][1])
+            if token:
+                result[user_id][1].add(token)
+        for user_id, token in Device.objects.filter(user_id__in=user_ids).exclude(expo_token='').values_list('user_id', 'expo_token'):
+            result[user_id][1].add(token)
+        return result
+
+    def add_subscriptions(self, store_ids, user_ids):
+        tokens_by_user = self._tokens_of_users(user_ids)
+        rows = [
+            self.model(store_id=store_id, user_id=user_id, gender=gender, expo_token=token)
+            for store_id in store_ids
+            for user_id, (gender, tokens) in tokens_by_user.items()
+            for token in tokens
+        ]
+        self.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+    def remove_subscriptions(self, store_ids, user_ids):
+        self.filter(store_id__in=store_ids, user_id__in=user_ids).delete()
+
+    def _drop_stale_holders(self, tokens, user_id):
+        """
+        Drops the rows of `tokens` of other users who no longer hold them, e.g. the
+        previous owner of a moved device. Users who still have the token in Device
+        or ExtraUserInformation.expoToken keep it, like in live_push_tokens_queryset().
+        """
+        from accounts.models import Device, ExtraUserInformation
+
+        if not tokens:
+            return
+        holders = set(Device.objects.filter(expo_token__in=tokens).values_list('user_id', 'expo_token'))
+        holders |= set(ExtraUserInformation.objects.filter(expoToken__in=tokens).values_list('user_id', 'expoToken'))
+        stale_ids = [
+            row_id
+            for row_id, holder_id, token in self.filter(expo_token__in=tokens).exclude(user_id=user_id).values_list('id', 'user_id', 'expo_token')
+            if (holder_id, token) not in holders
+        ]
+        self.filter(id__in=stale_ids).delete()
+
+    @transaction.atomic
+    def rebuild_user(self, user_id):
+        """Recomputes all rows of one user, e.g. after a device or gender change."""
+        gender, tokens = self._tokens_of_users([user_id])[user_id]
+        self.filter(user_id=user_id).delete()
+        self._drop_stale_holders(tokens, user_id)
+        store_ids = list(Store.objects.filter(subscriptions=user_id).values_list('id', flat=True))
+        self.bulk_create([
+            self.model(store_id=store_id, user_id=user_id, gender=gender, expo_token=token)
+            for store_id in store_ids
+            for token in tokens
+        ], batch_size=1000, ignore_conflicts=True)
+
+    def remove_user_token(self, user_id, token):
+        """
+        Drops one token of a user, unless the user still has it in the other place
+        (Device or ExtraUserInformation.expoToken). Only deletes, so it is safe while
+        the user itself is being deleted.
+        """
+        from accounts.models import Device, ExtraUserInformation
+
+        if not token:
+            return
+        if Device.objects.filter(user_id=user_id, expo_token=token).exists():
+            return
+        if ExtraUserInformation.objects.filter(user_id=user_id, expoToken=token).exists():
+            return
+        self.filter(user_id=user_id, expo_token=token).delete()
+
+    @transaction.atomic
+    def rebuild_all(self):
+        """Recomputes the whole table, see the rebuild_push_audience command."""
+        self.all().delete()
+        subscriptions = Store.subscriptions.through.objects.values_list('store_id', 'customuser_id')
+        store_ids_by_user = {}
+        for store_id, user_id in subscriptions.iterator(chunk_size=5000):
+            store_ids_by_user.setdefault(user_id, []).append(store_id)
+        user_ids = list(store_ids_by_user)
+        for i in range(0, len(user_ids), 500):
+            tokens_by_user = self._tokens_of_users(user_ids[i:i + 500])
+            self.bulk_create([
+                self.model(store_id=store_id, user_id=user_id, gender=gender, expo_token=token)
+                for user_id, (gender, tokens) in tokens_by_user.items()
+                for store_id in store_ids_by_user[user_id]
+                for token in tokens
+            ], batch_size=1000, ignore_conflicts=True)
+
+
+class PushAudience(models.Model):
+    """
+    Precomputed push audience: one row per (store, subscriber, Expo token), with the
+    subscriber's gender, so a push fan-out reads a ready-made token list.
+    Maintained by the Store.subscriptions m2m signal and the Device /
+    ExtraUserInformation signals below.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='push_audience')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='push_audience')
+    gender = models.IntegerField(null=True, blank=True) # ExtraUserInformation.gender, null if unknown
+    expo_token = models.CharField(max_length=255)
+
+    objects = PushAudienceManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'user', 'expo_token'], name='unique_push_audience_row'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'gender'], name='push_audience_store_gender'),
+            models.Index(fields=['expo_token'], name='push_audience_token'),
+        ]
+
+    def __str__(self):
+        return f"{self.store_id} / {self.user_id}: {self.expo_token}"
+
+@receiver(m2m_changed, sender=Store.subscriptions.through)
+def update_push_audience_on_subscription(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse=False: store.subscriptions.add(user), reverse=True: user.subscribed_stores.add(store)
+    if action == 'post_add':
+        store_ids, user_ids = (list(pk_set), [instance.pk]) if reverse else ([instance.pk], list(pk_set))
+        PushAudience.objects.add_subscriptions(store_ids, user_ids)
+    elif action == 'post_remove':
+        store_ids, user_ids = (list(pk_set), [instance.pk]) if reverse else ([instance.pk], list(pk_set))
+        PushAudience.objects.remove_subscriptions(store_ids, user_ids)
+    elif action == 'post_clear':
+        if reverse:
+            PushAudience.objects.filter(user_id=instance.pk).delete()
+        else:
+            PushAudience.objects.filter(store_id=instance.pk).delete()
+
+@receiver(post_save, sender='accounts.Device')
+def update_push_audience_on_device_save(sender, instance, **kwargs):
+    # New and moved devices and new tokens; rebuild_user also drops the token from the previous owner
+    if any(field_changed(instance, name) for name in instance.TRACKED_FIELDS):
+        PushAudience.objects.rebuild_user(instance.user_id)
+
+@receiver(post_save, sender='accounts.ExtraUserInformation')
+def update_push_audience_on_extra_info_save(sender, instance, **kwargs):
+    # Gender or legacy token changes; other saves (e.g. the push digest setting) don't touch the audience
+    if field_changed(instance, 'gender') or field_changed(instance, 'expoToken'):
+        PushAudience.objects.rebuild_user(instance.user_id)
+
+@receiver(post_delete, sender='accounts.Device')
+def update_push_audience_on_device_delete(sender, instance, **kwargs):
+    PushAudience.objects.remove_user_token(instance.user_id, instance.expo_token)
+
+@receiver(post_delete, sender='accounts.ExtraUserInformation')
+def update_push_audience_on_extra_info_delete(sender, instance, **kwargs):
+    PushAudience.objects.remove_user_token(instance.user_id, instance.expoToken)
+    PushAudience.objects.filter(user_id=instance.user_id).update(gender=None)
+
 class SubscriptionData(models.Model):
     """
     Stores user subscriptions to specific stores.
@@ -334,6 +987,7 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from django.utils import timezone
+from datetime import timedelta
 import json
 
 class GmailToken(models.Model):
@@ -455,6 +1109,121 @@ class GmailToken(models.Model):
         }
 
 
+class ImapSyncState(models.Model):
+    """
+    Watermark of the incremental IMAP sync (deals/imap_sync.py), one row per mailbox.
+    last_uid is only meaningful as long as the server reports the same UIDVALIDITY.
+    """
+    mailbox = models.CharField(max_length=255, unique=True) # e.g. "gijsgprojects@gmail.com/inbox"
+    uidvalidity = models.BigIntegerField(null=True, blank=True)
+    last_uid = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.mailbox}: UIDVALIDITY {self.uidvalidity}, last UID {self.last_uid}"
+
+
+class GeminiAnalysisCache(models.Model):
+    """
+    Gemini results keyed on the cleaned email HTML, the prompt version and the
+    prompt context, so re-sent newsletters reuse the earlier result instead of
+    a new LLM call. See deals/analysis_cache.py.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key[:12]}... ({self.hits} hits)"
+
+
+class PushTicket(models.Model):
+    """
+    Ticket id returned by Expo for a sent push notification. Kept until its
+    receipt has been checked by deals.push.check_push_receipts.
+    """
+    ticket_id = models.CharField(max_length=64, unique=True)
+    expo_token = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.ticket_id} -> {self.expo_token}"
+
+
+class PushOutbox(models.Model):
+    """
+    A push notification waiting to be sent. Rows are written in the same
+    transaction as the GmailSaleAnalysis / SaleMessage they announce and are
+    sent by the drain_push_outbox task (deals/push_outbox.py), which retries
+    failed tokens with backoff.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    idempotency_key = models.CharField(max_length=100, unique=True) # e.g. "analysis:12", one notification per source
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, null=True, blank=True)
+    genders = models.JSONField(null=True, blank=True) # audience of `store`, None = all subscribers
+    tokens = models.JSONField(null=True, blank=True) # explicit recipients, replaces the store audience when set; pinned to the resolved audience on the first attempt
+    title = models.CharField(max_length=255)
+    subtitle = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now) # also the lease expiry while 'sending'
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='push_outbox_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
+
+
+class PushDigestItem(models.Model):
+    """
+    A notification held back for one device, because its user wants a digest or
+    the device hit the push rate cap. Sent combined with the other items of the
+    device at due_at by deals.push_coalescing.flush_due_digests.
+    """
+    expo_token = models.CharField(max_length=255, db_index=True)
+    title = models.CharField(max_length=255) # store name
+    subtitle = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    due_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.expo_token}: {self.title} (due {self.due_at})"
+
+
+class PushDeliveryWindow(models.Model):
+    """
+    Number of pushes sent to a device in the current rate limit window
+    (PUSH_RATE_LIMIT_WINDOW_MINUTES), see deals.push_coalescing.
+    """
+    expo_token = models.CharField(max_length=255, unique=True)
+    window_start = models.DateTimeField(db_index=True)
+    sent_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.expo_token}: {self.sent_count} since {self.window_start}"
+
+
 class Click(models.Model):
     """
     This model keeps track of the clicks from users on a store page.
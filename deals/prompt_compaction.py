@@ -0,0 +1,92 @@
+"""
+Compaction of slimmed email text (deals.html_slimming) to a token budget
+before it is put into the Gemini prompt.
+
+Lines are deduplicated, footer/legal boilerplate is dropped, and when the text
+is still over budget the most useful lines are kept: the top of the email,
+prices, percentages, call-to-action links and the lines around prices (product
+blocks). Kept lines stay in their original order. When even the best line is
+over budget, its start is kept.
+"""
+import re
+
+CHARS_PER_TOKEN = 4  # rough estimate for Dutch/English text with URLs
+
+PRICE = re.compile(r'(?:€|eur\b|\$|£)\s?\d|\d+[.,]\d{2}\s?(?:€|eur\b)|\d+[.,](?:-|–)', re.IGNORECASE)
+PERCENTAGE = re.compile(r'\d+\s?%')
+LINK = re.compile(r'\]\((?:https?:)?//')
+CTA = re.compile(
+    r'\[[^\]]*\b(?:shop|bekijk|ontdek|koop|bestel|sale|korting|deal|aanbieding|nu|view|buy|discover|more)\b[^\]]*\]\(',
+    re.IGNORECASE,
+)
+LEGAL = re.compile(
+    r'afmelden|uitschrijven|unsubscribe|privacy|cookie|algemene voorwaarden|terms and conditions|'
+    r'©|copyright|alle rechten|all rights reserved|je ontvangt deze e-?mail|you are receiving|'
+    r'bekijk (?:deze e-?mail )?(?:online|in je browser)|view (?:this email )?in (?:your )?browser|'
+    r'kvk|btw-?nummer|voeg .* toe aan je adresboek',
+    re.IGNORECASE,
+)
+HEAD_LINES = 15  # the first lines usually hold the headline and the main offer
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _is_priced(line) -> bool:
+    return bool(PRICE.search(line) or PERCENTAGE.search(line))
+
+
+def compact_email_text(text: str, token_budget: int) -> str:
+    """
+    Returns `text` reduced to roughly `token_budget` tokens, see the module docstring.
+    """
+    seen = set()
+    lines = []
+    for line in (text or '').split('\n'):
+        line = line.strip()
+        key = line.lower()
+        if not line or key in seen:
+            continue
+        seen.add(key)
+        if LEGAL.search(line) and not _is_priced(line):
+            continue
+        lines.append(line)
+
+    compacted = '\n'.join(lines)
+    if estimate_tokens(compacted) <= token_budget:
+        return compacted
+
+    priced = [_is_priced(line) for line in lines]
+    scores = []
+    for i, line in enumerate(lines):
+        score = 0
+        if i < HEAD_LINES:
+            score += 2
+        if priced[i]:
+            score += 3
+        if CTA.search(line):
+            score += 2
+        elif LINK.search(line):
+            score += 1
+        # Name, image and link of a product are usually right above or below its price
+        if (i > 0 and priced[i - 1]) or (i + 1 < len(lines) and priced[i + 1]):
+            score += 1
+        scores.append(score)
+
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    kept = set()
+    used = 0
+    for i in sorted(range(len(lines)), key=lambda i: (-scores[i], i)):
+        size = len(lines[i]) + 1
+        if used + size > budget_chars:
+            if kept:
+                continue
+            # The best line alone is over budget (slimmed marketing HTML is often one long
+            # line); keep its start rather than sending Gemini an empty email
+            lines[i] = lines[i][:budget_chars - 1]
+            size = budget_chars
+        kept.add(i)
+        used += size
+
+    return '\n'.join(line for i, line in enumerate(lines) if i in kept)
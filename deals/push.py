@@ -0,0 +1,183 @@
+"""
+Expo push notifications.
+
+send_push_notifications() posts the 100-message chunks to Expo with bounded
+parallelism and stores the returned ticket ids (PushTicket). The periodic
+check_push_receipts task fetches the receipts for those tickets in bulk and
+removes tokens Expo reports as DeviceNotRegistered, the same way the app does
+when it unregisters a device (Device row deleted, ExtraUserInformation.expoToken
+cleared).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from deals.models import PushAudience, PushTicket, ScrapeData
+from deals.http_clients import expo_session, EXPO_TIMEOUT
+from deals.worker_pool import run_in_threads
+
+import requests
+
+EXPO_PUSH_URL = 'https://exp.host/--/api/v2/push/send'
+EXPO_RECEIPTS_URL = 'https://exp.host/--/api/v2/push/getReceipts'
+EXPO_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+}
+PUSH_CHUNK_SIZE = 100  # Expo limit per send request
+RECEIPT_CHUNK_SIZE = 1000  # Expo limit per getReceipts request
+RECEIPT_DELAY = timedelta(minutes=15)  # receipts are usually ready after 15 minutes
+RECEIPT_MAX_AGE = timedelta(hours=24)  # Expo drops receipts after a day
+
+
+def chunk_list(items, chunk_size):
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+def _log_push_error(error, major_error=True):
+    ScrapeData.objects.create(
+        task="Send Push Notifications",
+        succes=False,
+        major_error=major_error,
+        error=error,
+        execution_date=timezone.now()
+    )
+
+
+def _post_chunk(messages) -> dict:
+    """
+    Sends one chunk and returns {'tickets': [(ticket_id, token)], 'dead_tokens': [...],
+    'retry_tokens': [...], 'error': str|None}.
+    Runs in a worker thread, so it does not touch the database.
+    """
+    result = {'tickets': [], 'dead_tokens': [], 'retry_tokens': [], 'error': None}
+    try:
+        response = expo_session().post(EXPO_PUSH_URL, json=messages, headers=EXPO_HEADERS, timeout=EXPO_TIMEOUT)
+        response.raise_for_status()
+        tickets = response.json().get('data', [])
+    except Exception as e:
+        # Not accepted by Expo, whatever the cause; callers rely on only failing after the post
+        result['error'] = str(e)
+        result['retry_tokens'] = [message['to'] for message in messages]
+        return result
+
+    for message, ticket in zip(messages, tickets):
+        if ticket.get('status') == 'ok' and ticket.get('id'):
+            result['tickets'].append((ticket['id'], message['to']))
+        elif (ticket.get('details') or {}).get('error') == 'DeviceNotRegistered':
+            result['dead_tokens'].append(message['to'])
+        elif (ticket.get('details') or {}).get('error') == 'MessageRateExceeded':
+            result['retry_tokens'].append(message['to'])
+    return result
+
+
+def send_push_notifications(tokens, title, subtitle, body, data) -> int:
+    """
+    Sends the same notification to all `tokens`. Returns the number of accepted tickets.
+    """
+    messages = [{
+        'to': token,
+        'title': title,
+        'subtitle': subtitle,
+        'body': body,
+        'data': data
+    } for token in tokens]
+    return send_push_messages(messages)
+
+
+def send_push_messages(messages) -> int:
+    """
+    Sends prepared Expo messages, see deliver_push_messages().
+    Returns the number of accepted tickets.
+    """
+    accepted, _ = deliver_push_messages(messages)
+    return accepted
+
+
+def deliver_push_messages(messages, log_errors=True) -> tuple:
+    """
+    Sends prepared Expo messages in chunks of 100, with at most EXPO_PUSH_CONCURRENCY
+    requests in flight, and stores the tickets for receipt checking.
+    Returns (number of accepted tickets, tokens worth retrying), the latter being
+    the tokens of failed requests and of MessageRateExceeded tickets.
+    """
+    chunks = list(chunk_list(messages, PUSH_CHUNK_SIZE))
+    results = run_in_threads(_post_chunk, chunks, max_workers=settings.EXPO_PUSH_CONCURRENCY)
+
+    tickets = []
+    dead_tokens = []
+    retry_tokens = []
+    for result in results:
+        if result['error'] and log_errors:
+            print(f"Failed to send batch: {result['error']}")
+            _log_push_error(result['error'])
+        tickets.extend(result['tickets'])
+        dead_tokens.extend(result['dead_tokens'])
+        retry_tokens.extend(result['retry_tokens'])
+
+    PushTicket.objects.bulk_create(
+        [PushTicket(ticket_id=ticket_id, expo_token=token) for ticket_id, token in tickets],
+        batch_size=500,
+        ignore_conflicts=True
+    )
+    if dead_tokens:
+        deactivate_expo_tokens(dead_tokens)
+    return len(tickets), retry_tokens
+
+
+def deactivate_expo_tokens(tokens):
+    """Stops sending to tokens Expo reported as DeviceNotRegistered."""
+    from accounts.models import Device, ExtraUserInformation
+
+    tokens = list(set(tokens))
+    Device.objects.filter(expo_token__in=tokens).delete()
+    ExtraUserInformation.objects.filter(expoToken__in=tokens).update(expoToken=None)
+    # .update() sends no signals, so clear the precomputed audience directly
+    PushAudience.objects.filter(expo_token__in=tokens).delete()
+
+
+def check_push_receipts() -> int:
+    """
+    Fetches the receipts of tickets older than RECEIPT_DELAY in bulk, deactivates
+    DeviceNotRegistered tokens and deletes the checked tickets.
+    Tickets without a receipt after RECEIPT_MAX_AGE are dropped.
+    Returns the number of deactivated tokens.
+    """
+    now = timezone.now()
+    PushTicket.objects.filter(created_at__lt=now - RECEIPT_MAX_AGE).delete()
+
+    pending = list(
+        PushTicket.objects.filter(created_at__lt=now - RECEIPT_DELAY)
+        .order_by('created_at')
+        .values_list('id', 'ticket_id', 'expo_token')[:RECEIPT_CHUNK_SIZE * 10]
+    )
+
+    dead_tokens = []
+    checked_ids = []
+    for chunk in chunk_list(pending, RECEIPT_CHUNK_SIZE):
+        token_by_ticket = {ticket_id: token for _, ticket_id, token in chunk}
+        try:
+            response = expo_session().post(
+                EXPO_RECEIPTS_URL, json={'ids': list(token_by_ticket)}, headers=EXPO_HEADERS, timeout=EXPO_TIMEOUT
+            )
+            response.raise_for_status()
+            receipts = response.json().get('data', {})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _log_push_error(f"Fetching push receipts failed: {e}", major_error=False)
+            continue
+
+        for pk, ticket_id, token in chunk:
+            receipt = receipts.get(ticket_id)
+            if receipt is None:
+                continue  # not ready yet
+            checked_ids.append(pk)
+            if receipt.get('status') == 'error' and (receipt.get('details') or {}).get('error') == 'DeviceNotRegistered':
+                dead_tokens.append(token)
+
+    if dead_tokens:
+        deactivate_expo_tokens(dead_tokens)
+    for ids in chunk_list(checked_ids, RECEIPT_CHUNK_SIZE):
+        PushTicket.objects.filter(id__in=ids).delete()
+    return len(set(dead_tokens))
@@ -0,0 +1,215 @@
+"""
+Per-device coalescing and rate limiting of push notifications.
+
+Every message leaving the outbox goes through route_messages():
+
+- devices whose user set ExtraUserInformation.pushDigestMinutes get the
+  message held back as a PushDigestItem, due one window after the first
+  held-back item of that device
+- devices that already got PUSH_RATE_LIMIT_PER_DEVICE pushes in the current
+  window (PUSH_RATE_LIMIT_WINDOW_MINUTES) get it held back until the window ends
+- everything else is sent right away and counted against the cap
+
+flush_due_digests() (every minute) sends the held-back items per device as a
+single notification: the item itself when there is only one, otherwise a
+digest naming the stores, opening the newest deal.
+
+The cap is counted per worker without row locks, so concurrent workers can
+overshoot it slightly; it is a volume limit, not a guarantee. Sends that Expo
+did not accept are given back (release_sends), so the retry is counted once.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from deals.models import PushDigestItem, PushDeliveryWindow
+from deals.push import chunk_list, deliver_push_messages
+
+QUERY_CHUNK_SIZE = 1000
+DIGEST_CLAIM_LEASE = timedelta(minutes=5)  # claimed items are retried after this if the run dies
+
+
+def _digest_minutes_by_token(tokens) -> dict:
+    """Returns {token: minutes} for the tokens whose user wants a digest."""
+    from accounts.models import Device, ExtraUserInformation
+
+    minutes_by_token = {}
+    for chunk in chunk_list(tokens, QUERY_CHUNK_SIZE):
+        minutes_by_token.update(
+            Device.objects.filter(expo_token__in=chunk, user__extrauserinformation__pushDigestMinutes__gt=0)
+            .values_list('expo_token', 'user__extrauserinformation__pushDigestMinutes')
+        )
+        minutes_by_token.update(
+            ExtraUserInformation.objects.filter(expoToken__in=chunk, pushDigestMinutes__gt=0)
+            .values_list('expoToken', 'pushDigestMinutes')
+        )
+    return minutes_by_token
+
+
+def _reserve_sends(tokens, now) -> dict:
+    """
+    Counts one push for every token that is under the cap. Returns
+    {token: window end} for the tokens that are over it.
+    """
+    window = timedelta(minutes=settings.PUSH_RATE_LIMIT_WINDOW_MINUTES)
+    capped = {}
+    for chunk in chunk_list(tokens, QUERY_CHUNK_SIZE):
+        states = {state.expo_token: state for state in PushDeliveryWindow.objects.filter(expo_token__in=chunk)}
+        changed = []
+        new = []
+        for token in chunk:
+            state = states.get(token)
+            if state is None:
+                new.append(PushDeliveryWindow(expo_token=token, window_start=now, sent_count=1))
+                continue
+            if now - state.window_start >= window:
+                state.window_start = now
+                state.sent_count = 0
+            if state.sent_count >= settings.PUSH_RATE_LIMIT_PER_DEVICE:
+                capped[token] = state.window_start + window
+                continue
+            state.sent_count += 1
+            changed.append(state)
+        PushDeliveryWindow.objects.bulk_update(changed, ['window_start', 'sent_count'], batch_size=500)
+        PushDeliveryWindow.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+    return capped
+
+
+def release_sends(tokens):
+    """Gives back the sends _reserve_sends() counted for tokens whose push was not accepted, so a retry isn't counted twice."""
+    for chunk in chunk_list(list(tokens), QUERY_CHUNK_SIZE):
+        PushDeliveryWindow.objects.filter(expo_token__in=chunk, sent_count__gt=0).update(sent_count=F('sent_count') - 1)
+
+
+def _hold_back(messages_with_due_at):
+    """Stores (message, due_at) pairs as digest items. A device keeps the due_at of its earliest pending item."""
+    tokens = list({message['to'] for message, _ in messages_with_due_at})
+    pending_due = {}
+    for chunk in chunk_list(tokens, QUERY_CHUNK_SIZE):
+        pending_due.update(
+            PushDigestItem.objects.filter(expo_token__in=chunk)
+            .values('expo_token').annotate(first_due_at=Min('due_at'))
+            .values_list('expo_token', 'first_due_at')
+        )
+    PushDigestItem.objects.bulk_create([
+        PushDigestItem(
+            expo_token=message['to'],
+            title=message['title'][:255],
+            subtitle=message['subtitle'][:255],
+            body=message['body'],
+            data=message['data'],
+            due_at=min(due_at, pending_due.get(message['to'], due_at)),
+        )
+        for message, due_at in messages_with_due_at
+    ], batch_size=500)
+
+
+def route_messages(messages) -> list:
+    """
+    Holds back the messages for digest users and capped devices (see the module
+    docstring) and returns the messages to send now.
+    """
+    if not messages:
+        return []
+    now = timezone.now()
+    digest_minutes = _digest_minutes_by_token([message['to'] for message in messages])
+
+    held_back = []
+    candidates = []
+    for message in messages:
+        minutes = digest_minutes.get(message['to'])
+        if minutes:
+            held_back.append((message, now + timedelta(minutes=minutes)))
+        else:
+            candidates.append(message)
+
+    capped = _reserve_sends([message['to'] for message in candidates], now)
+    send_now = []
+    for message in candidates:
+        if message['to'] in capped:
+            held_back.append((message, capped[message['to']]))
+        else:
+            send_now.append(message)
+
+    if held_back:
+        _hold_back(held_back)
+    return send_now
+
+
+def build_digest_message(token, items) -> dict:
+    """One notification for the held-back `items` of a device, oldest first."""
+    newest = items[-1]
+    if len(items) == 1:
+        return {'to': token, 'title': newest.title, 'subtitle': newest.subtitle, 'body': newest.body, 'data': newest.data}
+
+    store_names = list(dict.fromkeys(item.title for item in reversed(items)))
+    if len(store_names) == 1:
+        body = f"Bekijk de nieuwe deals van {store_names[0]}."
+    elif len(store_names) <= 3:
+        body = f"Bekijk de nieuwe deals van {', '.join(store_names[:-1])} en {store_names[-1]}."
+    else:
+        body = f"Bekijk de nieuwe deals van {', '.join(store_names[:2])} en {len(store_names) - 2} andere winkels."
+    return {
+        'to': token,
+        'title': f"{len(items)} nieuwe deals",
+        'subtitle': newest.subtitle,
+        'body': body,
+        'data': newest.data,  # opens the newest deal
+    }
+
+
+def flush_due_digests(limit=2000) -> int:
+    """
+    Sends the held-back items of every device with a due item (see the module
+    docstring). Capped devices are postponed to the end of their window and
+    failed devices are retried when the claim lease expires. Returns the number of sent digests.
+    """
+    now = timezone.now()
+    tokens = list(
+        PushDigestItem.objects.filter(due_at__lte=now)
+        .values_list('expo_token', flat=True).distinct()[:limit]
+    )
+    if not tokens:
+        return 0
+
+    # Claim the due items by moving them out of reach of a concurrent run
+    items_by_token = {}
+    with transaction.atomic():
+        for chunk in chunk_list(tokens, QUERY_CHUNK_SIZE):
+            items = list(
+                PushDigestItem.objects.select_for_update(skip_locked=True)
+                .filter(expo_token__in=chunk, due_at__lte=now).order_by('created_at', 'id')
+            )
+            PushDigestItem.objects.filter(id__in=[item.id for item in items]).update(due_at=now + DIGEST_CLAIM_LEASE)
+            for item in items:
+                items_by_token.setdefault(item.expo_token, []).append(item)
+    if not items_by_token:
+        return 0
+
+    capped = _reserve_sends(list(items_by_token), now)
+    for token, window_end in capped.items():
+        PushDigestItem.objects.filter(id__in=[item.id for item in items_by_token[token]]).update(due_at=window_end)
+
+    messages = [build_digest_message(token, items) for token, items in items_by_token.items() if token not in capped]
+    _, retry_tokens = deliver_push_messages(messages)
+    release_sends(retry_tokens)
+    retry_tokens = set(retry_tokens)
+
+    done_ids = [
+        item.id
+        for token, items in items_by_token.items() if token not in capped and token not in retry_tokens
+        for item in items
+    ]
+    for ids in chunk_list(done_ids, QUERY_CHUNK_SIZE):
+        PushDigestItem.objects.filter(id__in=ids).delete()
+    return len(messages) - len(retry_tokens)
+
+
+def purge_delivery_windows() -> int:
+    """Deletes the rate limit counters of devices that got nothing for a day."""
+    cutoff = timezone.now() - timedelta(days=1)
+    deleted, _ = PushDeliveryWindow.objects.filter(window_start__lt=cutoff).delete()
+    return deleted
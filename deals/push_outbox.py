@@ -0,0 +1,158 @@
+"""
+Durable outbox for push notifications.
+
+Producers (analyse_emails*, disperse_sales) call enqueue_push() inside the
+transaction that creates the analysis or marks the sale message as sent, so a
+notification is stored exactly when its source is. The drain_push_outbox task
+claims due rows with SELECT ... FOR UPDATE SKIP LOCKED, holds back what the
+per-device coalescing (deals.push_coalescing) defers, sends the rest through
+deals.push and reschedules the tokens that failed with exponential backoff.
+A store audience is resolved once and pinned on the row (tokens), so a retry
+only goes to the devices that did not get the notification yet.
+
+The idempotency key (one per source object) makes enqueueing the same
+notification twice a no-op. A claimed row gets a lease (next_attempt_at); if the
+worker dies while sending, the row is picked up again once the lease expires.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from deals.models import PushOutbox, ScrapeData
+from deals.push import deliver_push_messages
+from deals.push_coalescing import release_sends, route_messages
+
+
+def enqueue_push(idempotency_key, title, subtitle, body, data, store=None, genders=None, tokens=None) -> PushOutbox:
+    """
+    Stores a notification for `store`'s push audience (optionally limited to
+    `genders`), or for an explicit list of `tokens`. Call it inside the
+    transaction that creates the source object.
+    """
+    entry, created = PushOutbox.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults={
+            'store': store,
+            'genders': genders,
+            'tokens': list(tokens) if tokens is not None else None,
+            'title': title[:255],
+            'subtitle': subtitle[:255],
+            'body': body,
+            'data': data,
+        }
+    )
+    if created:
+        # Don't wait for the next beat run; the row is only visible after commit
+        from deals.tasks import drain_push_outbox_task
+        transaction.on_commit(lambda: drain_push_outbox_task.delay())
+    return entry
+
+
+def claim_due_entries(limit) -> list:
+    """
+    Claims up to `limit` due rows for this worker: pending rows whose
+    next_attempt_at has passed and 'sending' rows whose lease has expired.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            PushOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[PushOutbox.STATUS_PENDING, PushOutbox.STATUS_SENDING], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        PushOutbox.objects.filter(id__in=[entry.id for entry in entries]).update(
+            status=PushOutbox.STATUS_SENDING,
+            next_attempt_at=now + timedelta(seconds=settings.PUSH_OUTBOX_LEASE_SECONDS),
+        )
+    return entries
+
+
+def _recipients(entry) -> list:
+    if entry.tokens is not None:
+        return entry.tokens
+    if entry.store is None:
+        return []
+    return entry.store.get_push_tokens(genders=entry.genders)
+
+
+def deliver_entry(entry) -> bool:
+    """
+    Sends one claimed row. Failed tokens are kept on the row and retried with
+    exponential backoff until PUSH_OUTBOX_MAX_ATTEMPTS. Returns True when done.
+    """
+    now = timezone.now()
+    pending = entry.tokens
+    try:
+        recipients = _recipients(entry)
+        if entry.tokens is None:
+            # Pin the store audience, so a retry goes to these devices and not to whoever subscribed since
+            entry.tokens = recipients
+            entry.save(update_fields=['tokens'])
+        pending = recipients
+        messages = [{
+            'to': token,
+            'title': entry.title,
+            'subtitle': entry.subtitle,
+            'body': entry.body,
+            'data': entry.data,
+        } for token in recipients]
+        # Digest users and capped devices get it later, see deals/push_coalescing.py.
+        # Atomic, so a failure neither counts sends nor stores digest items.
+        with transaction.atomic():
+            messages = route_messages(messages)
+        # Expo errors come back as retry tokens; an exception from here on is raised
+        # after the chunks were posted, and resending them would push twice
+        pending = []
+        _, retry_tokens = deliver_push_messages(messages, log_errors=False)
+        # They are routed, and counted against the cap, again on the retry
+        release_sends(retry_tokens)
+        error = f"{len(retry_tokens)} of {len(messages)} tokens failed" if retry_tokens else ''
+    except Exception as e:
+        # Only retry the tokens that were not handed to the digest or Expo yet
+        retry_tokens = pending
+        error = str(e)
+
+    entry.attempts += 1
+    entry.last_error = error
+    if not error:
+        entry.status = PushOutbox.STATUS_SENT
+        entry.sent_at = now
+    elif entry.attempts >= settings.PUSH_OUTBOX_MAX_ATTEMPTS:
+        entry.status = PushOutbox.STATUS_FAILED
+        ScrapeData.objects.create(
+            task="Send Push Notifications",
+            succes=False,
+            major_error=True,
+            error=f"Giving up on push {entry.idempotency_key} after {entry.attempts} attempts: {error}",
+            execution_date=now
+        )
+    else:
+        # Only resend to the tokens that failed, the others already got it
+        entry.tokens = retry_tokens
+        entry.status = PushOutbox.STATUS_PENDING
+        backoff = settings.PUSH_OUTBOX_RETRY_DELAY_SECONDS * 2 ** (entry.attempts - 1)
+        entry.next_attempt_at = now + timedelta(seconds=min(backoff, settings.PUSH_OUTBOX_MAX_RETRY_DELAY_SECONDS))
+    entry.save(update_fields=['attempts', 'last_error', 'status', 'sent_at', 'tokens', 'next_attempt_at'])
+    return entry.status == PushOutbox.STATUS_SENT
+
+
+def drain_push_outbox(batch_size=None) -> int:
+    """
+    Sends due outbox rows until none are left. Returns the number of sent rows.
+    """
+    batch_size = batch_size or settings.PUSH_OUTBOX_BATCH_SIZE
+    sent = 0
+    while True:
+        entries = claim_due_entries(batch_size)
+        if not entries:
+            return sent
+        sent += sum(1 for entry in entries if deliver_entry(entry))
+
+
+def purge_push_outbox() -> int:
+    """Deletes sent rows older than PUSH_OUTBOX_RETENTION_DAYS. Failed rows are kept for inspection."""
+    cutoff = timezone.now() - timedelta(days=settings.PUSH_OUTBOX_RETENTION_DAYS)
+    deleted, _ = PushOutbox.objects.filter(status=PushOutbox.STATUS_SENT, sent_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,103 @@
+"""
+Process-wide lookup table from sender domain to Store id.
+
+Matching an incoming GmailMessage used to scan every Store per domain candidate.
+This module keeps the domains of all stores in memory so that matching is a dict
+lookup per candidate, no matter how many stores exist.
+
+The index is updated incrementally by the Store post_save / post_delete signals
+(see deals/models.py). Other processes (Celery workers, other gunicorn workers)
+do not receive those signals, so the index is also rebuilt once it is older
+than INDEX_MAX_AGE seconds.
+"""
+import threading
+import time
+
+INDEX_MAX_AGE = 300  # seconds
+
+_lock = threading.Lock()
+_stores_by_domain = None  # {domain: set(store_id)}
+_domains_by_store = None  # {store_id: set(domain)}
+_built_at = 0.0
+
+
+def _normalize_domains(domain_list):
+    return {d.strip().lower() for d in (domain_list or []) if isinstance(d, str) and d.strip()}
+
+
+def _build():
+    from deals.models import Store
+
+    stores_by_domain = {}
+    domains_by_store = {}
+    for store_id, domain_list in Store.objects.values_list('id', 'domain_list'):
+        domains = _normalize_domains(domain_list)
+        domains_by_store[store_id] = domains
+        for domain in domains:
+            stores_by_domain.setdefault(domain, set()).add(store_id)
+    return stores_by_domain, domains_by_store
+
+
+def _ensure_index():
+    global _stores_by_domain, _domains_by_store, _built_at
+    if _stores_by_domain is not None and time.monotonic() - _built_at < INDEX_MAX_AGE:
+        return
+    stores_by_domain, domains_by_store = _build()
+    with _lock:
+        _stores_by_domain = stores_by_domain
+        _domains_by_store = domains_by_store
+        _built_at = time.monotonic()
+
+
+def invalidate_domain_index():
+    """Drop the index; it is rebuilt on the next lookup."""
+    global _stores_by_domain, _domains_by_store
+    with _lock:
+        _stores_by_domain = None
+        _domains_by_store = None
+
+
+def update_store_in_index(store_id, domain_list):
+    """Replace the domains of a single store in the index (no-op when not built yet)."""
+    with _lock:
+        if _stores_by_domain is None:
+            return
+        _remove_store(store_id)
+        domains = _normalize_domains(domain_list)
+        _domains_by_store[store_id] = domains
+        for domain in domains:
+            _stores_by_domain.setdefault(domain, set()).add(store_id)
+
+
+def remove_store_from_index(store_id):
+    with _lock:
+        if _stores_by_domain is None:
+            return
+        _remove_store(store_id)
+
+
+def _remove_store(store_id):
+    # Caller must hold _lock.
+    for domain in _domains_by_store.pop(store_id, set()):
+        store_ids = _stores_by_domain.get(domain)
+        if store_ids is None:
+            continue
+        store_ids.discard(store_id)
+        if not store_ids:
+            del _stores_by_domain[domain]
+
+
+def match_store_id(domain_candidates):
+    """
+    Returns the id of the first store that lists one of the domain candidates,
+    checking candidates in order. When several stores list the same domain the
+    oldest store (lowest id) wins, like the previous Store.objects.all() scan.
+    """
+    _ensure_index()
+    with _lock:
+        stores_by_domain = _stores_by_domain or {}
+        for domain in domain_candidates:
+            store_ids = stores_by_domain.get(domain.lower())
+            if store_ids:
+                return min(store_ids)
+    return None
@@ -1,5 +1,12 @@
 from celery import shared_task
 from django.core.management import call_command
+from django.utils import timezone
+
+from deals.models import ActiveSale, ScrapeData
+from deals.url_resolution import resolve_and_save_url
+from deals.push import check_push_receipts
+from deals.push_outbox import drain_push_outbox, purge_push_outbox
+from deals.push_coalescing import flush_due_digests, purge_delivery_windows
 
 
 
@@ -19,4 +26,91 @@ def refresh_tokens_task():
     """
     Calls the Django management command to refresh tokens.
     """
-    call_command('refresh_tokens')
\ No newline at end of file
+    call_command('refresh_tokens')
+
+@shared_task(ignore_result=True)
+def resolve_sale_url(url):
+    """
+    Resolves the main_link of an analysis to the final sale page (deals/url_resolution.py).
+    Routed to the 'scrape' queue, see CELERY_TASK_ROUTES.
+    """
+    try:
+        resolve_and_save_url(url)
+    except Exception as e:
+        ScrapeData.objects.create(
+            task="Scrape General URL",
+            succes=False,
+            major_error=False,
+            error=f"An unexpected error occurred scraping {url}: {str(e)}",
+            execution_date=timezone.now()
+        )
+
+@shared_task(ignore_result=True)
+def check_push_receipts_task():
+    """
+    Checks the Expo receipts of sent push notifications and removes
+    DeviceNotRegistered tokens (deals/push.py).
+    """
+    try:
+        check_push_receipts()
+    except Exception as e:
+        ScrapeData.objects.create(
+            task="Check push receipts",
+            succes=False,
+            major_error=False,
+            error=str(e),
+            execution_date=timezone.now()
+        )
+
+@shared_task(ignore_result=True)
+def drain_push_outbox_task():
+    """
+    Sends the due notifications of the push outbox (deals/push_outbox.py).
+    Queued after every enqueue and by beat as a fallback for retries.
+    Routed to the 'push' queue, see CELERY_TASK_ROUTES.
+    """
+    try:
+        drain_push_outbox()
+        purge_push_outbox()
+    except Exception as e:
+        ScrapeData.objects.create(
+            task="Drain push outbox",
+            succes=False,
+            major_error=True,
+            error=str(e),
+            execution_date=timezone.now()
+        )
+
+@shared_task(ignore_result=True)
+def flush_push_digests_task():
+    """
+    Sends the held-back digest notifications that are due (deals/push_coalescing.py).
+    Routed to the 'push' queue, see CELERY_TASK_ROUTES.
+    """
+    try:
+        flush_due_digests()
+        purge_delivery_windows()
+    except Exception as e:
+        ScrapeData.objects.create(
+            task="Flush push digests",
+            succes=False,
+            major_error=True,
+            error=str(e),
+            execution_date=timezone.now()
+        )
+
+@shared_task(ignore_result=True)
+def expire_active_sales_task():
+    """
+    Removes the ActiveSale rows that left the feed window (ACTIVE_SALE_WINDOW_DAYS).
+    """
+    try:
+        ActiveSale.objects.expire()
+    except Exception as e:
+        ScrapeData.objects.create(
+            task="Expire active sales",
+            succes=False,
+            major_error=False,
+            error=str(e),
+            execution_date=timezone.now()
+        )
@@ -1,3 +1,22 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+
+from deals.html_slimming import _is_tracking_pixel
 
 # Create your tests here.
+
+
+class TrackingPixelTests(SimpleTestCase):
+    def test_size_attributes(self):
+        self.assertTrue(_is_tracking_pixel({'width': '1', 'height': '1'}))
+        self.assertTrue(_is_tracking_pixel({'width': '2px'}))
+        self.assertFalse(_is_tracking_pixel({'width': '600'}))
+
+    def test_style_sizes_match_the_attribute_sizes(self):
+        self.assertTrue(_is_tracking_pixel({'style': 'width:2px;height:2px'}))
+        self.assertTrue(_is_tracking_pixel({'style': 'width: 1px !important'}))
+        self.assertTrue(_is_tracking_pixel({'style': 'HEIGHT:0'}))
+
+    def test_other_properties_are_not_the_image_size(self):
+        self.assertFalse(_is_tracking_pixel({'style': 'border-width:1px;width:600px'}))
+        self.assertFalse(_is_tracking_pixel({'style': 'max-width:0'}))
+        self.assertFalse(_is_tracking_pixel({'style': 'line-height:0'}))
@@ -0,0 +1,80 @@
+"""
+Resolution of tracking links (main_link of an analysis) to the final sale page.
+
+This runs in the resolve_sale_url Celery task (deals/tasks.py) on its own
+'scrape' queue, so analysis and push notifications never wait for the proxy.
+The HTTP request happens outside any transaction; the Url row is written
+afterwards with a single get_or_create. Until it exists, get_sale_page_url()
+in deals/views.py falls back to the store's sale/home url.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from deals.models import ScrapeData, Url
+from deals.http_clients import proxy_session, PROXY_TIMEOUT
+
+import requests
+from urllib.parse import urlparse, urlunparse
+
+PROXIES = {
+    "http": f"http://{settings.PROXY_CAKE_USERNAME}:{settings.PROXY_CAKE_PASSWORD}@{settings.PROXY_CAKE_IP}:{settings.PROXY_CAKE_PORT}",
+    "https": f"http://{settings.PROXY_CAKE_USERNAME}:{settings.PROXY_CAKE_PASSWORD}@{settings.PROXY_CAKE_IP}:{settings.PROXY_CAKE_PORT}",
+}
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/114.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Connection": "keep-alive",
+}
+
+
+def strip_query_params(u: str) -> str:
+    parsed = urlparse(u)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+
+
+def resolve_and_save_url(url: str):
+    """
+    Follows the redirects of `url` through the proxy and saves the final url
+    (with and without query parameters). Returns the Url, or None on failure.
+    """
+    clean_url_key = url.strip()
+    existing = Url.objects.filter(url_ctrk=clean_url_key).first()
+    if existing:
+        return existing
+
+    try:
+        # stream=True: only the final url is needed, not the page itself
+        response = proxy_session().get(
+            clean_url_key,
+            headers=HEADERS,
+            proxies=PROXIES,
+            timeout=PROXY_TIMEOUT,
+            stream=True
+        )
+        response.close()
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        # This catches connection errors, timeouts, and HTTP errors after retries fail.
+        ScrapeData.objects.create(
+            task="Scrape General URL",
+            succes=False,
+            major_error=False,
+            error=f"Network/HTTP error scraping {url}: {str(e)}",
+            execution_date=timezone.now()
+        )
+        return None
+
+    redirected_url = response.url.strip()
+    url_object, _ = Url.objects.get_or_create(
+        url_ctrk=clean_url_key,
+        defaults={
+            'redirected_url': redirected_url,
+            'general_url': strip_query_params(redirected_url),
+            'last_scraped': timezone.now(),
+        }
+    )
+    return url_object
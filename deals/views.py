@@ -65,9 +65,13 @@ def parse_date_received(date_received):
         return f"{days} dag{'en' if days > 1 else ''} geleden"
 
 def get_sale_page_url(store:Store, url:str):
+    """
+    Returns the resolved sale page of a tracking link. Links are resolved in the
+    background (deals.tasks.resolve_sale_url); until then the store's sale or home url is used.
+    """
     client_url = None
-    if Url.objects.filter(url_ctrk=url.strip()).exists():
-        client_url = Url.objects.get(url_ctrk=url).general_url
+    if url:
+        client_url = Url.objects.filter(url_ctrk=url.strip()).values_list('general_url', flat=True).first()
     if not client_url:
         client_url = store.sale_url if store.sale_url else store.home_url
     return client_url
@@ -83,6 +87,7 @@ def public_deals_view(request, sales_per_page=9):
 
     # Base query to filter for valid deals
     # We combine all non-gender-specific filters here for clarity and robustness
+    # Not ActiveSale: this feed also shows the deals that are not new or better (is_new_deal_better)
     base_filters = Q(
         is_sale_mail=True,
         is_personal_deal=False,
@@ -105,7 +110,7 @@ def public_deals_view(request, sales_per_page=9):
         gender_filters = Q() 
 
     # Combine all filters to create the final queryset
-    analyses = GmailSaleAnalysis.objects.filter(base_filters & gender_filters).order_by('-message__received_date')
+    analyses = GmailSaleAnalysis.objects.filter(base_filters & gender_filters).select_related('message__store').order_by('-message__received_date')
 
     # --- GET and POST logic remain the same, but use the new analyses queryset ---
 
@@ -237,6 +242,7 @@ def client_deals_view(request, sales_per_page=9):
     gender_of_user = getattr(user.extrauserinformation, 'gender', None)
 
     # Base query to filter for valid deals, including subscribed stores and null check
+    # Not ActiveSale: this feed also shows the deals that are not new or better (is_new_deal_better)
     base_filters = Q(
         is_sale_mail=True,
         is_personal_deal=False,
@@ -260,7 +266,7 @@ def client_deals_view(request, sales_per_page=9):
         gender_filters = Q()
 
     # Combine all filters to create the final queryset
-    analyses = GmailSaleAnalysis.objects.filter(base_filters & gender_filters).select_related('message').order_by('-message__received_date')
+    analyses = GmailSaleAnalysis.objects.filter(base_filters & gender_filters).select_related('message__store').order_by('-message__received_date')
 
     if request.method == 'GET':
         paginator = Paginator(analyses, sales_per_page)
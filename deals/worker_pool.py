@@ -0,0 +1,74 @@
+"""
+Small helpers to run I/O bound work (Gemini, scraping, pushes) concurrently
+from management commands and Celery tasks.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: allows `rate` calls per `per` seconds, with bursts
+    of at most `rate` calls. acquire() blocks until a call is allowed.
+    """
+
+    def __init__(self, rate, per=60.0):
+        self.rate = float(rate)
+        self.per = float(per)
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated_at) * self.rate / self.per)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.per / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key, rate, per=60.0) -> RateLimiter:
+    """
+    Returns the process-wide limiter for `key` (e.g. an API key), so every
+    command and task using the same key shares one budget.
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(rate, per)
+            _rate_limiters[key] = limiter
+        return limiter
+
+
+def run_in_threads(func, items, max_workers=4) -> list:
+    """
+    Calls func(item) for every item with at most `max_workers` threads and
+    returns the results in the order of `items`.
+    With max_workers <= 1 everything runs in the calling thread.
+    Exceptions are not caught here; func should handle its own errors.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def call_and_close(item):
+        try:
+            return func(item)
+        finally:
+            # Every thread gets its own DB connection; don't leave them open.
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call_and_close, items))